@@ -0,0 +1,79 @@
+"""
+Contains a uniform cell list, a spatial index which sorts beads into
+cubic cells so that close pairs can be found without comparing every
+bead with every other bead.
+"""
+
+import numpy as np
+
+# the 27 cells around and including a given cell
+OFFSETS = np.array([(i, j, k) for i in (-1, 0, 1)
+                    for j in (-1, 0, 1) for k in (-1, 0, 1)])
+# half of the neighbours, so that each pair of cells is visited once
+HALF = [tuple(o) for o in OFFSETS if tuple(o) > (0, 0, 0)]
+
+
+class CellList(object):
+    def __init__(self, coords, size=1.2):
+        """
+        Sort the beads at <coords>, an (n, 3) array, into cubic cells of
+        side <size>, which must be at least the largest distance that will
+        be queried.
+        """
+        self.size = size
+        self.keys = np.floor(coords / size).astype(int)
+        self.cells = {}
+        for i, key in enumerate(map(tuple, self.keys)):
+            self.cells.setdefault(key, []).append(i)
+
+    def update(self, indices, coords):
+        """
+        Move the beads <indices> to the new positions <coords>.
+        """
+        indices = np.asarray(indices)
+        keys = np.floor(coords / self.size).astype(int)
+        changed = np.where(np.any(keys != self.keys[indices], axis=1))[0]
+        for c in changed:
+            i = indices[c]
+            old = tuple(self.keys[i])
+            self.cells[old].remove(i)
+            if not self.cells[old]:
+                del self.cells[old]
+            self.cells.setdefault(tuple(keys[c]), []).append(i)
+        self.keys[indices] = keys
+
+    def neighbours(self, coords):
+        """
+        Returns the indices of all beads in the cells around the points
+        <coords>, which includes every bead closer than the cell size to
+        any of them.
+        """
+        keys = np.floor(coords / self.size).astype(int)
+        keys = (keys[:, None, :] + OFFSETS[None, :, :]).reshape((-1, 3))
+        keys = np.unique(keys, axis=0)
+        found = [self.cells.get(key) for key in map(tuple, keys)]
+        found = [f for f in found if f]
+        if not found:
+            return np.zeros(0, dtype=int)
+        return np.concatenate(found)
+
+    def pairs(self):
+        """
+        Returns all pairs of beads in the same or in neighbouring cells,
+        as two index arrays i, j with i < j.
+        """
+        I, J = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)]
+        for key, beads in self.cells.items():
+            beads = np.array(beads)
+            i, j = np.triu_indices(len(beads), 1)
+            I.append(beads[i])
+            J.append(beads[j])
+            for off in HALF:
+                other = self.cells.get(
+                    (key[0] + off[0], key[1] + off[1], key[2] + off[2]))
+                if other:
+                    i, j = np.meshgrid(beads, other, indexing='ij')
+                    I.append(i.ravel())
+                    J.append(j.ravel())
+        I, J = np.concatenate(I), np.concatenate(J)
+        return np.minimum(I, J), np.maximum(I, J)
@@ -6,17 +6,156 @@ check for violations and count bonds.
 import numpy as np
 import copy
 import sys
+from CellList import CellList
+import scattering
+import kernels
+import trajectory
+import profiling
+
+# systems with more beads than this use a cell list by default
+CELL_LIST_MIN_BEADS = 1000
+# the fraction of a surface which disks placed at random positions
+# without overlaps can cover at most
+RSA_JAMMING = .547
+# the Monte Carlo moves, and the most beads a crankshaft move rotates
+MOVES = ('pivot', 'crankshaft', 'end', 'shift')
+CRANKSHAFT_BEADS = 3
+# distance from the axis below which beads count as on it
+COLLINEAR = 1e-6
+
+
+def bendAngles(coords):
+    """
+    Returns the bend angles at the interior beads of the chains
+    <coords>, an array of shape (..., length, 3), as an array of shape
+    (..., length - 2).
+    """
+    bonds = np.diff(coords, axis=-2)
+    a, b = bonds[..., 1:, :], bonds[..., :-1, :]
+    cos = np.sum(a * b, axis=-1) / (np.linalg.norm(a, axis=-1)
+                                     * np.linalg.norm(b, axis=-1))
+    return np.arccos(np.clip(cos, -1, 1))
+
+
+def rotationMatrix(tX, tY, tZ):
+    """
+    Returns the matrix for rotations by <tX>, <tY> and <tZ> around the
+    x, y and z axes.
+    """
+    rotX = np.array(
+        [[1, 0, 0], [0, np.cos(tX), -np.sin(tX)],
+         [0, np.sin(tX), np.cos(tX)]]
+    )
+    rotY = np.array(
+        [[np.cos(tY), 0, np.sin(tY)], [0, 1, 0],
+         [-np.sin(tY), 0, np.cos(tY)]]
+    )
+    rotZ = np.array(
+        [[np.cos(tZ), -np.sin(tZ), 0],
+         [np.sin(tZ), np.cos(tZ), 0], [0, 0, 1]]
+    )
+    return rotX.dot(rotY).dot(rotZ)
+
+
+def axisRotation(axis, t):
+    """
+    Returns the matrix for a rotation by <t> around <axis>.
+    """
+    x, y, z = axis / np.linalg.norm(axis)
+    K = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    return np.eye(3) + np.sin(t) * K + (1 - np.cos(t)) * K.dot(K)
+
+
+def hexagonalLattice(box, spacing):
+    """
+    Returns the points of a hexagonal lattice with <spacing> which fit
+    in the square [0, <box>]^2, as an array of shape (n, 2).
+    """
+    dy = spacing * np.sqrt(3) / 2
+    points = []
+    for i in range(int(box / dy) + 1):
+        x0 = spacing / 2 * (i % 2)
+        x = x0 + spacing * np.arange(int((box - x0) / spacing) + 1)
+        points.append(np.column_stack((x, np.full(len(x), i * dy))))
+    return np.concatenate(points)
+
+
+def graftSites(number, box, minDist=1., maxTries=30):
+    """
+    Returns <number> random points in the square [0, <box>)^2 which are
+    at least <minDist> apart, as an array of shape (number, 2). The
+    points are placed one at a time, and each candidate is only compared
+    with the points in the neighbouring cells of a grid with one point
+    per cell at most, so this takes linear time. If that fails after
+    <maxTries> candidates per point, or the density is close to the
+    jamming limit of such random placement, the points are instead
+    picked at random from the widest hexagonal lattice which holds
+    enough of them.
+    Raises ValueError if <number> points don't fit even in the densest
+    hexagonal packing.
+    """
+    # a little margin against rounding in the lattice distances
+    spacing = minDist * (1 + 1e-9)
+    densest = len(hexagonalLattice(box, spacing))
+    if number > densest:
+        raise ValueError(
+            '%d chains can\'t be grafted at least %g apart on a %g x %g '
+            'surface, which holds at most %d (%.2f per unit area). Use a '
+            'larger -box or fewer chains.'
+            % (number, minDist, box, box, densest, densest / box ** 2))
+    pitch = minDist / np.sqrt(2)
+    cells = -np.ones((int(box / pitch) + 1,) * 2, dtype=int)
+    points = np.zeros((number, 2))
+    k, tries = 0, 0
+    # don't bother close to the jamming density
+    if number > .9 * RSA_JAMMING * box ** 2 / (np.pi / 4 * minDist ** 2):
+        tries = maxTries * number
+    while k < number and tries < maxTries * number:
+        tries += 1
+        p = np.random.rand(2) * box
+        ix, iy = (p / pitch).astype(int)
+        near = cells[max(ix - 2, 0):ix + 3, max(iy - 2, 0):iy + 3]
+        near = near[near >= 0]
+        if len(near) and (np.min(np.sum((points[near] - p) ** 2, axis=1))
+                          < minDist ** 2):
+            continue
+        cells[ix, iy] = k
+        points[k] = p
+        k += 1
+    if k == number:
+        return points
+    # bisect for the widest lattice spacing which fits enough points
+    low, high = spacing, box
+    for i in range(40):
+        mid = (low + high) / 2
+        if len(hexagonalLattice(box, mid)) >= number:
+            low = mid
+        else:
+            high = mid
+    lattice = hexagonalLattice(box, low)
+    lattice += np.random.rand(2) * (box - lattice.max(axis=0))
+    return lattice[np.random.permutation(len(lattice))[:number]]
 
 
 class Chains(object):
     def __init__(self, number=0, length=0, box=0, maxAngle=np.pi / 2,
                  beta=0.0, surface=False, outFile='out.pdb', initialConf=None,
-                 grid=None):
+                 grid=None, cellList=None):
         """
         Make and initialize a set of <number> chains of length <length>,
         spread over a square surface of side <box>, MxN if <grid> is
-        specified, otherwise randomly.
+        specified, otherwise randomly. Overlaps and bonds are found with
+        a cell list if <cellList> is True, or if it is None and the
+        system is large.
         """
+        self.bonds, self.angles = None, None
+        self.lastMove = None
+        # (chain, first bead, end, old coordinates) of each moved segment
+        self.journal = []
+        self.cells = None
+        if cellList is None:
+            cellList = number * length > CELL_LIST_MIN_BEADS
+        self.cellList = cellList
         if number > 0:
             self.number = number
             self.length = length
@@ -26,175 +165,400 @@ class Chains(object):
             self.surface = surface
             self.outFile = outFile
             bonds = None
-            # read the initial conformation from pdb
+            # read the initial conformation from a binary or pdb trajectory
             if initialConf:
                 print("Reading initial conformation from the last frame of %s."
                       % initialConf)
-                # go to the first line of the last frame
-                fp = open(initialConf, 'r')
-                i = 0
-                for line in fp:
-                    i += 1
-                    if line.startswith('MODEL'):
-                        linesBefore = i
-                fp.seek(0)
-                for i in range(linesBefore):
-                    fp.readline()
-                self.coords = []
-                for i in range(number):
-                    self.coords.append(np.ones((length, 3)))
-                    for j in range(length):
-                        line = fp.readline()
-                        self.coords[-1][j, :] = np.array(
-                            map(float,
-                                [line[30:38], line[38:46], line[46:54]])
-                        )
-                    fp.readline()  # TER
-                fp.close()
+                self.coords = trajectory.readFrame(initialConf)[0]
+                if self.coords.shape != (number, length, 3):
+                    raise ValueError('%s holds a different system'
+                                     % initialConf)
             # make a random one
             else:
-                while bonds is None:
-                    sys.stdout.write(
-                        "Generating initial arrangement of chains... ")
-                    self.coords = []
-                    if grid:
-                        assert grid[0] * grid[1] >= number
-                        dx = box / (grid[0] + 1)
-                        x = np.linspace(0, 1, grid[0] + 1)[:-1] * box + dx / 2
-                        dy = box / (grid[1] + 1)
-                        y = np.linspace(0, 1, grid[1] + 1)[:-1] * box + dy / 2
-                        X, Y = np.meshgrid(x, y)
-                        X = X.flatten()
-                        Y = Y.flatten()
-                    else:
-                        X = np.random.rand(number) * box
-                        Y = np.random.rand(number) * box
-                    for i in range(number):
-                        self.coords.append(np.ones((length, 3)))
-                        self.coords[-1][:, 0] = X[i]
-                        self.coords[-1][:, 1] = Y[i]
-                        self.coords[-1][:, 2] = np.arange(.5, length)
-                    bonds, angles = self.check()
-                    if bonds is None:
-                        sys.stdout.write('failed. Trying again.\n')
-                    else:
-                        sys.stdout.write('success!\n')
-
-    def randomRotation(self, number=1, size=1):
+                sys.stdout.write(
+                    "Generating initial arrangement of chains... ")
+                self.coords = np.ones((number, length, 3))
+                if grid:
+                    assert grid[0] * grid[1] >= number
+                    dx = box / (grid[0] + 1)
+                    x = np.linspace(0, 1, grid[0] + 1)[:-1] * box + dx / 2
+                    dy = box / (grid[1] + 1)
+                    y = np.linspace(0, 1, grid[1] + 1)[:-1] * box + dy / 2
+                    X, Y = np.meshgrid(x, y)
+                    X = X.flatten()
+                    Y = Y.flatten()
+                else:
+                    try:
+                        X, Y = graftSites(number, box).T
+                    except ValueError:
+                        sys.stdout.write('failed.\n')
+                        raise
+                self.coords[:, :, 0] = X[:number, None]
+                self.coords[:, :, 1] = Y[:number, None]
+                self.coords[:, :, 2] = np.arange(.5, length)
+                bonds, angles = self.check()
+                if bonds is None:
+                    sys.stdout.write('failed.\n')
+                    raise ValueError('The chains overlap in the initial '
+                                     'arrangement, the box is too small.')
+                sys.stdout.write('success!\n')
+
+    def randomRotation(self, number=1, size=1, draws=None):
+        """
+        Rotates the tail of a random chain around a random pivot bead,
+        <number> times. The chain, pivot and three angles of each move
+        come from a row of <draws>, uniform random numbers of shape
+        (number, 5), which are drawn here if not given.
+        """
+        if draws is None:
+            draws = np.random.rand(number, 5)
+        self.journal = []
+        self.oldBonds, self.oldAngles = self.bonds, self.angles
         for cycle in range(number):
-            m = np.random.randint(self.number)
-            n = np.random.randint(self.length - 1)
+            m = int(draws[cycle, 0] * self.number)
+            n = int(draws[cycle, 1] * (self.length - 1))
             # set the random angle to the same value as the maximum
             # allowed angle - should be the right sort of size:
             thetaMax = self.maxAngle * size
-            tX = (1 - 2 * np.random.rand()) * thetaMax * (1 + self.surface)
-            tY = (1 - 2 * np.random.rand()) * thetaMax * (1 + self.surface)
-            tZ = (1 - 2 * np.random.rand()) * thetaMax * (1 + self.surface)
-            rotX = np.array(
-                [[1, 0, 0], [0, np.cos(tX), -np.sin(tX)],
-                 [0, np.sin(tX), np.cos(tX)]]
-            )
-            rotY = np.array(
-                [[np.cos(tY), 0, np.sin(tY)], [0, 1, 0],
-                 [-np.sin(tY), 0, np.cos(tY)]]
-            )
-            rotZ = np.array(
-                [[np.cos(tZ), -np.sin(tZ), 0],
-                 [np.sin(tZ), np.cos(tZ), 0], [0, 0, 1]]
-            )
-            rot = rotX.dot(rotY).dot(rotZ)
-            origin = self.coords[m][n + 1, :]
-            self.oldCoords = copy.deepcopy(self.coords)
-            for i in range(n + 2, self.length):
-                self.coords[m][i, :] = (
-                    origin + np.dot(rot, self.coords[m][i, :] - origin))
+            tX, tY, tZ = ((1 - 2 * draws[cycle, 2:5]) * thetaMax
+                          * (1 + self.surface))
+            rot = rotationMatrix(tX, tY, tZ)
+            origin = self.coords[m, n + 1, :]
+            self.journal.append((m, n + 2, self.length,
+                                 self.coords[m, n + 2:].copy()))
+            self.coords[m, n + 2:] = (
+                origin + (self.coords[m, n + 2:] - origin).dot(rot.T))
+            self.updateCells(m, n + 2, self.length)
+        # checkMove() can only handle a single move
+        self.lastMove = None
+        if number == 1:
+            self.lastMove = (m, n + 2, self.length, [n + 1])
+
+    def crankshaft(self, size=1, draws=None):
+        """
+        Rotates one to CRANKSHAFT_BEADS consecutive interior beads of a
+        random chain around the axis through their two neighbours, which
+        keeps all bond lengths. The chain, the number of beads, their
+        position and the angle, up to <size> half turns, come from the
+        first four of the five uniform random numbers <draws>. Beads
+        which lie on the axis aren't moved, which metropolis() skips.
+        Raises ValueError for chains of less than three beads.
+        """
+        if self.length < 3:
+            raise ValueError('Crankshaft moves need chains of at least three '
+                             'beads')
+        if draws is None:
+            draws = np.random.rand(5)
+        m = int(draws[0] * self.number)
+        k = 1 + int(draws[1] * min(CRANKSHAFT_BEADS, self.length - 2))
+        i = int(draws[2] * (self.length - k - 1))
+        j = i + k + 1
+        origin = self.coords[m, i]
+        axis = self.coords[m, j] - origin
+        axis = axis / np.linalg.norm(axis)
+        segment = self.coords[m, i + 1:j] - origin
+        if np.all(np.linalg.norm(segment - np.outer(segment.dot(axis), axis),
+                                 axis=-1) < COLLINEAR):
+            # the beads lie on the axis, so nothing would move
+            self.record(m, 0, 0, [])
+            return
+        self.record(m, i + 1, j, [i, j])
+        rot = axisRotation(axis, (1 - 2 * draws[3]) * np.pi * size)
+        self.coords[m, i + 1:j] = (
+            origin + (self.coords[m, i + 1:j] - origin).dot(rot.T))
+        self.updateCells(m, i + 1, j)
+
+    def endRotation(self, size=1, draws=None):
+        """
+        Rotates the last bead of a random chain around its neighbour, or
+        for free chains the first bead in half of the cases. The chain,
+        the end and three angles come from the five uniform random
+        numbers <draws>, the angles scaled as in randomRotation().
+        """
+        if draws is None:
+            draws = np.random.rand(5)
+        m = int(draws[0] * self.number)
+        if self.surface or draws[1] >= .5:
+            end, hinge = self.length - 1, self.length - 2
+        else:
+            end, hinge = 0, 1
+        self.record(m, end, end + 1, [hinge])
+        tX, tY, tZ = ((1 - 2 * draws[2:5]) * self.maxAngle * size
+                      * (1 + self.surface))
+        origin = self.coords[m, hinge]
+        self.coords[m, end] = origin + (self.coords[m, end] - origin).dot(
+            rotationMatrix(tX, tY, tZ).T)
+        self.updateCells(m, end, end + 1)
+
+    def shiftChain(self, size=1, draws=None):
+        """
+        Shifts a whole random chain parallel to the surface, by up to
+        <size> bead diameters in x and y. The chain and the shift come
+        from the first three of the five uniform random numbers <draws>.
+        """
+        if draws is None:
+            draws = np.random.rand(5)
+        m = int(draws[0] * self.number)
+        self.record(m, 0, self.length, [])
+        self.coords[m, :, :2] += (1 - 2 * draws[1:3]) * size
+        self.updateCells(m, 0, self.length)
+
+    def move(self, kind, size=1, draws=None):
+        """
+        Makes a single move of type MOVES[<kind>], see the methods above.
+        """
+        if kind == 0:
+            self.randomRotation(1, size, None if draws is None
+                                else draws[None, :5])
+        elif kind == 1:
+            self.crankshaft(size, draws)
+        elif kind == 2:
+            self.endRotation(size, draws)
+        elif kind == 3:
+            self.shiftChain(size, draws)
+        else:
+            raise ValueError('Unknown move %r' % kind)
+
+    def record(self, m, a, b, hinges):
+        """
+        Saves beads <a> to <b> of chain <m> before a single move, for
+        restorePrevious() and checkMove(). The <hinges> are the beads at
+        which the bend angle changes, which the move keeps in place and
+        at the same distances from the moved beads.
+        """
+        self.journal = [(m, a, b, self.coords[m, a:b].copy())]
+        self.oldBonds, self.oldAngles = self.bonds, self.angles
+        self.lastMove = (m, a, b, hinges)
+
+    def updateCells(self, m, a, b):
+        """
+        Moves beads <a> to <b> of chain <m> in the cell list, if any.
+        """
+        if self.cells is not None and b > a:
+            first = m * self.length
+            self.cells.update(np.arange(first + a, first + b),
+                              self.coords[m, a:b])
 
     def restorePrevious(self):
-        if self.oldCoords is None:
+        if not self.journal:
             raise RuntimeError('No saved state to restore')
-        else:
-            self.coords = self.oldCoords
-            self.oldCoords = None
+        # undo the moves in reverse order, in case they overlap
+        for m, a, b, saved in reversed(self.journal):
+            self.coords[m, a:b] = saved
+            self.updateCells(m, a, b)
+        self.journal = []
+        self.bonds, self.angles = self.oldBonds, self.oldAngles
 
     def check(self):
-        bonds = 0
-        angles = []
-        # got to loop over chains first, beads i and i+1 should interact
-        # fully if they are on different chains...
-        for m in range(self.number):
-            angles_ = []
-            # check for angle violation on the current chain:
-            for i in range(1, self.length - 1):
-                a = self.coords[m][i + 1, :] - self.coords[m][i, :]
-                b = self.coords[m][i, :] - self.coords[m][i - 1, :]
-                angle = np.arccos(min(1, np.dot(a, b) / (np.linalg.norm(a)
-                                  * np.linalg.norm(b))))
-                if angle > self.maxAngle:
-                    return (None, None)
-                angles_.append(angle)
-            # check for overlap and surface/box violation on the current chain:
-            for i in range(self.length):
-                ri = self.coords[m][i]
-                if self.surface and (i > 0) and (ri[2] < 0.5):
-                    return (None, None)
-                if self.box:
-                    if ((ri[0] < 0) or (ri[0] > self.box) or (ri[1] < 0) or (ri[1] > self.box)):
-                        return (None, None)
-                for j in range(i - 1):
-                    rj = self.coords[m][j]
-                    if np.linalg.norm(ri - rj) < 1.0:
-                        return (None, None)
-                    # count bonds
-                    if np.linalg.norm(ri - rj) < 1.2:
-                        bonds += 1
-            # mn cross terms:
-            for n in range(m):
-                # check for overlap and bonds
-                for i in range(self.length):
-                    ri = self.coords[m][i]
-                    for j in range(self.length):
-                        rj = self.coords[n][j]
-                        if np.linalg.norm(ri - rj) < 1.0:
-                            return (None, None)
-                        # count bonds
-                        if np.linalg.norm(ri - rj) < 1.2:
-                            bonds += 1
-            angles.append(angles_)
-        return bonds, np.array(angles)
-
-    def debye(self, q):
-        res = np.zeros_like(q)
-        coords = np.array(self.coords).reshape((-1, 3))
-        for i in range(coords.shape[0]):
-            res[:] = res[:] + 1
-            for j in range(i):
-                r = np.linalg.norm(coords[i] - coords[j])
-                res[0] += 2
-                res[1:] = res[1:] + 2 * np.sin(q[1:] * r) / (q[1:] * r)
-        return res / res[0]
+        # check for angle violation:
+        angles = bendAngles(self.coords)
+        if np.any(angles > self.maxAngle):
+            return (None, None)
+        coords = self.beads
+        # check for surface/box violation:
+        if self.surface:
+            if np.any(self.coords[:, 1:, 2] < 0.5):
+                return (None, None)
+        if self.box:
+            if (np.any(coords[:, :2] < 0) or np.any(coords[:, :2] > self.box)):
+                return (None, None)
+        # check for overlap and count bonds:
+        if self.cellList:
+            self.cells = CellList(coords)
+        i, j, d = self.pairs(self.cells)
+        if np.any(d < 1.0):
+            return (None, None)
+        bonds = np.count_nonzero(d < 1.2)
+        self.bonds, self.angles = bonds, angles
+        return self.bonds, self.angles
+
+    def pairs(self, cells=None):
+        """
+        Returns the indices into self.beads of the pairs of beads i < j
+        which interact, and their distances. Beads i and i+1 only
+        interact if they are on different chains. With a cell list, the
+        candidate pairs come from <cells> or from a new one.
+        """
+        coords = self.beads
+        if self.cellList:
+            if cells is None:
+                cells = CellList(coords)
+            i, j = cells.pairs()
+        else:
+            i, j = np.triu_indices(len(coords), 1)
+        keep = ((i // self.length != j // self.length) | (j - i > 1))
+        i, j = i[keep], j[keep]
+        return i, j, np.linalg.norm(coords[i] - coords[j], axis=-1)
+
+    def checkMove(self):
+        """
+        Incremental version of check() for the last single move,
+        returning the same (bonds, angles) tuple. Every move rigidly
+        moves beads a to b of one chain m around hinge beads, which stay
+        in place at the same distances from the moved ones. So only the
+        angles at the hinges and the distances between the moved and the
+        other beads can change. The bond count is updated by the
+        difference over those pairs. Falls back on the full check() when
+        there is no previous result to update.
+        """
+        if ((self.lastMove is None) or (self.oldBonds is None)
+                or (self.cellList and self.cells is None)):
+            return self.check()
+        m, a, b, hinges = self.lastMove
+        if a >= b:
+            # nothing moved
+            self.bonds, self.angles = self.oldBonds, self.oldAngles
+            return self.bonds, self.angles
+        moved = self.coords[m, a:b]
+        # the angles at the hinges, chain ends having none:
+        interior = [h for h in hinges if 0 < h < self.length - 1]
+        angles = self.oldAngles
+        if interior:
+            h = np.array(interior)
+            new = bendAngles(self.coords[m, h[:, None] + [-1, 0, 1]])[:, 0]
+            if np.any(new > self.maxAngle):
+                return (None, None)
+            angles = angles.copy()
+            angles[m, h - 1] = new
+        # surface and box violations, the first bead being on the surface:
+        if self.surface and np.any(moved[max(1 - a, 0):, 2] < 0.5):
+            return (None, None)
+        if self.box:
+            if (np.any(moved[:, :2] < 0) or np.any(moved[:, :2] > self.box)):
+                return (None, None)
+        # overlaps and bonds with the other beads, skipping the hinges
+        # whose distances to the moved ones don't change:
+        oldMoved = self.journal[-1][3]
+        coords = self.beads
+        first = m * self.length
+        lo = first + min([a] + hinges)
+        hi = first + max([b] + [h + 1 for h in hinges])
+        if self.cells is not None:
+            new = self.cells.neighbours(moved)
+            old = self.cells.neighbours(oldMoved)
+            new = new[(new < lo) | (new >= hi)]
+            old = old[(old < lo) | (old >= hi)]
+        else:
+            new = old = np.r_[0:lo, hi:len(coords)]
+        dNew = np.linalg.norm(moved[:, None, :] - coords[None, new, :],
+                              axis=-1)
+        if np.any(dNew < 1.0):
+            return (None, None)
+        dOld = np.linalg.norm(oldMoved[:, None, :] - coords[None, old, :],
+                              axis=-1)
+        self.bonds = (self.oldBonds + np.count_nonzero(dNew < 1.2)
+                      - np.count_nonzero(dOld < 1.2))
+        self.angles = angles
+        return self.bonds, self.angles
+
+    def metropolis(self, draws, betas, size=1, goodSteps=0, outputFreq=1,
+                   backend='numpy', timer=None, moves=None, counts=None):
+        """
+        Runs one Monte Carlo step per row of <draws>, uniform random
+        numbers of shape (k, 6). The first five columns give a pivot
+        move of relative size <size>, and the last one decides the
+        Metropolis condition at the inverse temperature <betas>[i].
+        Stops early after an accepted step that makes the number of
+        accepted steps <goodSteps> a multiple of <outputFreq>, so that
+        output can be written. Returns the number of steps run, the new
+        number of accepted steps and whether output is due.
+
+        If <moves> is given, step i makes move MOVES[<moves>[i]] instead,
+        of size <size>[<moves>[i]] if <size> is a sequence, skipping
+        moves which leave every bead in place. The tried and accepted
+        steps of each move are added to the rows of <counts>, an array
+        of shape (len(MOVES), 2), if given.
+
+        The 'numba' <backend> runs pivot steps in a compiled kernel,
+        which makes the same decisions for the same draws. If a
+        profiling.Timer <timer> is given, the time spent in each part of
+        the steps is added to it.
+        """
+        lap = profiling.skip if timer is None else timer.lap
+        if (backend == 'numba' and self.bonds is not None
+                and moves is None):
+            self.angles = self.angles.copy()
+            steps, goodSteps, self.bonds, output = kernels.pivotSteps(
+                self.coords, self.angles, self.bonds, draws, betas,
+                self.maxAngle, self.maxAngle * size * (1 + self.surface),
+                self.surface, float(self.box), goodSteps, outputFreq)
+            lap('kernel')
+            self.journal = []
+            # the kernel doesn't maintain the cell list, so the next
+            # checkMove() rebuilds it
+            self.cells = None
+            return steps, goodSteps, output
+        if moves is not None:
+            sizes = np.broadcast_to(size, len(MOVES))
+        for i in range(len(draws)):
+            oldBonds = self.bonds or 0
+            kind = 0
+            if moves is None:
+                self.randomRotation(1, size, draws[i:i + 1, :5])
+            else:
+                kind = moves[i]
+                self.move(kind, sizes[kind], draws[i, :5])
+                if self.lastMove[1] >= self.lastMove[2]:
+                    # nothing moved, which isn't counted as a step that
+                    # was tried or accepted
+                    self.restorePrevious()
+                    lap('move')
+                    continue
+            lap('move')
+            bonds, angles = self.checkMove()
+            lap('check')
+            if bonds is None:
+                keep = False
+            elif ((oldBonds - bonds <= 0)
+                  or (draws[i, 5] < np.exp(-betas[i] * (oldBonds - bonds)))):
+                keep = True
+            else:
+                keep = False
+            lap('metropolis')
+            if counts is not None:
+                counts[kind] += 1, keep
+            if keep:
+                goodSteps += 1
+                if goodSteps % outputFreq == 0:
+                    return i + 1, goodSteps, True
+            else:
+                self.restorePrevious()
+                lap('restore')
+        return len(draws), goodSteps, False
+
+    def debye(self, q, exact=False):
+        """
+        Normalized Debye sum over all beads, see scattering.debye().
+        """
+        return scattering.debye(self.beads, q, exact=exact)
 
     def dump(self, append=False):
         fp = open(self.outFile, {True: 'a', False: 'w'}[append])
-        fp.write('MODEL \n')
-        for j in range(self.number):
-            for i in range(self.length):
-                if i == 0:
-                    name = 'A'
-                elif i == 1:
-                    name = 'B'
-                else:
-                    name = 'C'
-                i_ = j * self.length + i
-                fp.write(
-                    "ATOM    %3d    %s AAA A %3d    %8.3f%8.3f%8.3f\n"
-                    % (i_, name, j,
-                       self.coords[j][i, 0],
-                       self.coords[j][i, 1],
-                       self.coords[j][i, 2])
-                )
-            fp.write('TER   \n')
-        fp.write('ENDMDL\n')
+        fp.write(trajectory.pdbFrame(self.coords))
         fp.close()
 
+    def state(self):
+        """
+        Returns copies of the coordinates, bond count and bend angles,
+        which setState() can restore on this or another instance.
+        """
+        angles = None if self.angles is None else self.angles.copy()
+        return self.coords.copy(), self.bonds, angles
+
+    def setState(self, state):
+        coords, self.bonds, self.angles = state
+        self.coords[:] = coords
+        self.journal = []
+        self.lastMove = None
+        self.cells = None
+
+    @property
+    def beads(self):
+        """
+        View of the coordinates as one (number * length, 3) array, with
+        bead i of chain m at row m * length + i.
+        """
+        return self.coords.reshape((-1, 3))
+
     def copy(self):
         return copy.deepcopy(self)
@@ -0,0 +1,213 @@
+"""
+Benchmarks of the Monte Carlo hot paths and of short whole simulations,
+for a few representative systems with fixed seeds. The results are
+written as JSON, and can be compared against an earlier run to catch
+regressions or to quantify an optimization.
+"""
+
+import numpy as np
+import contextlib
+import tempfile
+import tracemalloc
+import platform
+import json
+import time
+import os
+import io
+import sys
+import chainSimulation
+import kernels
+import Chains
+
+# name: (Simulation settings, number of steps of the whole simulation)
+CONFIGS = {
+    'free40': (dict(length=40, box=10., maxAngle=np.pi / 2, beta=1.1,
+                    stepsize=.05), 5000),
+    'free200': (dict(length=200, box=10., maxAngle=np.pi / 2, beta=1.1,
+                     stepsize=.05), 2000),
+    'grid10x10': (dict(number=100, grid=[10, 10], length=40, box=30.,
+                       maxAngle=np.pi / 2, beta=1.1, stepsize=.05,
+                       surface=True), 1000),
+}
+SEED = 1
+
+
+def usage():
+    msg = (
+        '\nUsage:\n\n'
+        'benchmark.py [options]\n\n'
+        '  -configs <a,b,..>: systems to benchmark, out of %s\n'
+        '                     (default all)\n'
+        '  -backend <s>:      "numpy" or "numba" (default numpy)\n'
+        '  -output <file>:    where to write the results (default\n'
+        '                     benchmark.json)\n'
+        '  -baseline <file>:  earlier results to compare with\n'
+        '  -tolerance <x>:    relative slowdown reported as a regression\n'
+        '                     (default 0.1)\n\n'
+        'Exits with status 1 if any timing regressed compared with the\n'
+        'baseline.\n' % ','.join(CONFIGS)
+    )
+    print(msg)
+    exit()
+
+
+def timeit(fn, minTime=.2, repeat=3):
+    """
+    Returns the time per call of <fn>, as the best of <repeat> batches
+    lasting at least <minTime> seconds each.
+    """
+    best = np.inf
+    for r in range(repeat):
+        calls, t0 = 0, time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            t = time.perf_counter() - t0
+            if t >= minTime:
+                break
+        best = min(best, t / calls)
+    return best
+
+
+def quiet():
+    """
+    Context which hides the progress output of the simulation code.
+    """
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def benchFunctions(settings, directory):
+    """
+    Times the Chains methods on one system, returning seconds per call.
+    """
+    np.random.seed(SEED)
+    keys = ('number', 'length', 'box', 'maxAngle', 'beta', 'surface', 'grid')
+    with quiet():
+        chains = Chains.Chains(
+            outFile=os.path.join(directory, 'bench.pdb'),
+            **dict({'number': 1}, **{k: v for k, v in settings.items()
+                                     if k in keys}))
+    chains.check()
+    q = np.linspace(0, .5, 501)
+    size = settings['stepsize']
+
+    def move():
+        chains.randomRotation(1, size, np.random.rand(1, 5))
+        chains.restorePrevious()
+
+    def checkMove():
+        chains.randomRotation(1, size, np.random.rand(1, 5))
+        chains.checkMove()
+        chains.restorePrevious()
+
+    def metropolis():
+        chains.metropolis(np.random.rand(100, 6), np.full(100, chains.beta),
+                          size, outputFreq=10 ** 9)
+
+    res = {
+        'check': timeit(chains.check),
+        'randomRotation': timeit(move),
+        'checkMove': timeit(checkMove),
+        'metropolisStep': timeit(metropolis) / 100,
+        'debye': timeit(lambda: chains.debye(q)),
+        'dump': timeit(lambda: chains.dump(append=True)),
+    }
+    return {key: {'seconds': value, 'perSecond': 1 / value}
+            for key, value in res.items()}
+
+
+def benchSimulation(settings, nSteps, backend, directory):
+    """
+    Runs a short simulation with Debye output, returning the time per
+    step, the steps per second and the peak traced memory in bytes.
+    """
+    opts = dict(settings, nSteps=nSteps, outputFreq=100, debye=True,
+                debye_n=501, seed=SEED, backend=backend,
+                outputFile=os.path.join(directory, 'bench'),
+                progress=lambda *args: None)
+    with quiet():
+        if backend == 'numba':
+            # compile outside the timing
+            chainSimulation.simulate(**dict(opts, nSteps=10))
+        t0 = time.perf_counter()
+        chainSimulation.simulate(**opts)
+        t = time.perf_counter() - t0
+        tracemalloc.start()
+        chainSimulation.simulate(**opts)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'seconds': t / nSteps, 'perSecond': nSteps / t,
+            'peakMemory': peak}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the ratio of every timing to the baseline, returning the
+    number of timings more than <tolerance> slower.
+    """
+    regressions = 0
+    for config, benches in sorted(results['results'].items()):
+        for name, res in sorted(benches.items()):
+            try:
+                old = baseline['results'][config][name]['seconds']
+            except KeyError:
+                continue
+            ratio = res['seconds'] / old
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('   %-10s %-15s %10.3g s  %6.2fx baseline%s'
+                  % (config, name, res['seconds'], ratio, flag))
+    return regressions
+
+
+def main(argv):
+    if '-help' in argv:
+        usage()
+    configs = chainSimulation.parse(argv, '-configs', ','.join(CONFIGS))
+    backend = chainSimulation.parse(argv, '-backend', 'numpy')
+    output = chainSimulation.parse(argv, '-output', 'benchmark.json')
+    baselineFile = chainSimulation.parse(argv, '-baseline', None)
+    tolerance = float(chainSimulation.parse(argv, '-tolerance', .1))
+    if backend == 'numba' and not kernels.HAVE_NUMBA:
+        print("Numba isn't installed, using the numpy backend instead.")
+        backend = 'numpy'
+
+    results = {
+        'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'python': platform.python_version(),
+                 'numpy': np.__version__, 'machine': platform.machine(),
+                 'processor': platform.processor(), 'backend': backend,
+                 'seed': SEED},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for config in configs.split(','):
+            settings, nSteps = CONFIGS[config]
+            print('Benchmarking %s...' % config)
+            res = benchFunctions(settings, directory)
+            res['simulation'] = benchSimulation(settings, nSteps, backend,
+                                                directory)
+            results['results'][config] = res
+            for name, r in res.items():
+                print('   %-15s %10.3g s  %10.1f /s'
+                      % (name, r['seconds'], r['perSecond'])
+                      + ('  peak %.1f MB' % (r['peakMemory'] / 1e6)
+                         if 'peakMemory' in r else ''))
+
+    with open(output, 'w') as fp:
+        json.dump(results, fp, indent=1)
+    print('Results written to %s' % output)
+    if baselineFile is not None:
+        with open(baselineFile) as fp:
+            baseline = json.load(fp)
+        print('\nCompared with %s:' % baselineFile)
+        regressions = compare(results, baseline, tolerance)
+        if regressions:
+            print('\n%d regressions' % regressions)
+            exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
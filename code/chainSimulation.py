@@ -4,10 +4,22 @@ Main script which runs simulations with command-line argument parameters.
 
 import numpy as np
 import os
+import json
 import Chains
+import kernels
+import profiling
+import structure
+import scattering
+import trajectory
+import writers
 import time
 import sys
 
+# tries of a move between changes of its step size with -adapt, and the
+# range of step sizes allowed
+ADAPT_TRIES = 50
+STEPSIZE_RANGE = (1e-3, 1.)
+
 
 def usage():
     msg = (
@@ -17,7 +29,7 @@ def usage():
         '                    hard but inert surface (default no)\n'
         '  -number <n>:      simulates a collection of n chains (default 1)\n'
         '                    can also be "MxN" which will lay out a grid of\n'
-        '                    chains on a surface, if one is used'
+        '                    chains on a surface, if one is used\n'
         '  -length <n>:      makes coils of n beads, with contour lengths\n'
         '                    n - 1 (default 50)\n'
         '  -box <d>:         grafts the chains on a square of side length d\n'
@@ -28,6 +40,23 @@ def usage():
         '                    where the well width is 0.2 (default 0.0)\n'
         '  -stepsize <s>     number between 0 and 1 for the size of random\n'
         '                    rotation steps (default 1)\n'
+        '  -pivot <w>:       relative weight of pivot moves, which rotate\n'
+        '                    the tail of a chain around a random bead\n'
+        '                    (default 1)\n'
+        '  -crankshaft <w>:  relative weight of crankshaft moves, which\n'
+        '                    rotate up to 3 interior beads around the axis\n'
+        '                    through their neighbours (default 0)\n'
+        '  -end <w>:         relative weight of moves rotating an end bead\n'
+        '                    around its neighbour (default 0)\n'
+        '  -shift <w>:       relative weight of moves shifting a whole chain\n'
+        '                    along the surface by up to s, with -surface\n'
+        '                    only (default 0)\n'
+        '  -adapt <n>:       during the first n steps, which should be part\n'
+        '                    of the burn-in, scales the step size of each\n'
+        '                    move towards the -target acceptance rate\n'
+        '                    (default 0, never)\n'
+        '  -target <a>:      the acceptance rate -adapt aims for\n'
+        '                    (default 0.3)\n'
         '  -ramps <n>:       ramp up beta from 0 n times for simulated\n'
         '                    annealing, where n = 0 gives constant beta as\n'
         '                    specified by -beta. After each ramp, beta is\n'
@@ -42,11 +71,53 @@ def usage():
         '                    output\n'
         '  -debye_max <max>  maximum q value for Debye calculation\n'
         '  -debye_n <n>      number of q values for Debye calculation\n'
+        '  -debye_exact      if present, sums the Debye terms exactly over\n'
+        '                    all pairs instead of binning the distances\n'
         '  -debye_dist <d>   scaling factor for coordinates used for Debye\n'
-        '                    (does not affect output coordinates\n (default 1)'
+        '                    (does not affect output coordinates)\n'
+        '                    (default 1)\n'
+        '  -debye_burnin <n> number of accepted steps before the Debye\n'
+        '                    curves are averaged into <outputFile>.debye,\n'
+        '                    and the pair distances histogrammed into\n'
+        '                    <outputFile>.hist for rescaling (default 0)\n'
+        '  -debye_blocks <n> also average blocks of n frames, for error\n'
+        '                    bars (default 0, no blocks)\n'
+        '  -debye_flush <n>  writes <outputFile>.debye every n averaged\n'
+        '                    frames (default 100)\n'
+        '  -debye_stream     if present, only keeps the running average\n'
+        '                    and doesn\'t write every frame to\n'
+        '                    <outputFile>.npz\n'
         '  -append:          if present, continues the existing simulation\n'
         '                    specified by -outputFile, which must match the\n'
         '                    other settings (default no)\n'
+        '  -seed <n>:        seeds the random number generator, so that a\n'
+        '                    run can be repeated (default random)\n'
+        '  -backend <s>:     "numpy" or "numba", where numba runs the steps\n'
+        '                    between outputs in a compiled kernel if Numba\n'
+        '                    is installed (default numpy)\n'
+        '  -format <s>:      "pdb" or "bin", the trajectory format, where\n'
+        '                    bin writes a compact binary <outputFile>.bin\n'
+        '                    which trajectory.py converts to pdb\n'
+        '                    (default pdb)\n'
+        '  -checkpoint <n>:  saves the full simulation state to\n'
+        '                    <outputFile>.chk every n steps (default never)\n'
+        '  -resume:          if present, continues exactly from the\n'
+        '                    checkpoint of -outputFile, which must match\n'
+        '                    the other settings (default no)\n'
+        '  -profile <n>:     every n steps, appends the time spent in each\n'
+        '                    part of the loop, the acceptance rate and the\n'
+        '                    trajectory bytes written since the last time\n'
+        '                    as a JSON line to <outputFile>.prof (default\n'
+        '                    never)\n'
+        '  -observables:     if present, writes the radius of gyration,\n'
+        '                    end-to-end distance, persistence length and\n'
+        '                    clusters of bonded beads of every output frame\n'
+        '                    to <outputFile>.obs\n'
+        '  -buffer <kB>:     output buffer size per file, written to disk\n'
+        '                    on a background thread when full (default\n'
+        '                    1024)\n'
+        '  -flushTime <s>:   longest time output waits in the buffer\n'
+        '                    (default 5)\n'
     )
     print(msg)
     exit()
@@ -59,134 +130,517 @@ def parse(argv, key, default):
         return default
 
 
-# parse arguments
-if '-help' in sys.argv:
-    usage()
-surface = '-surface' in sys.argv
-append = '-append' in sys.argv
-number = parse(sys.argv, '-number', 1)
-if 'x' in number:
-    grid = list(map(int, number.split('x')))
-    number = grid[0] * grid[1]
-else:
-    grid = None
-    number = int(number)
-length = int(parse(sys.argv, '-length', 50))
-box = float(parse(sys.argv, '-box', 10))
-maxAngle = float(parse(sys.argv, '-maxAngle', 90)) * np.pi / 180.0
-beta = float(parse(sys.argv, '-beta', 0))
-stepsize = float(parse(sys.argv, '-stepsize', 1.))
-ramps = int(parse(sys.argv, '-ramps', 0))
-outputFile = parse(sys.argv, '-outputFile', 'out')
-outputFreq = int(parse(sys.argv, '-outputFreq', 10))
-nSteps = int(parse(sys.argv, '-steps', 1000))
-debye = '-debye' in sys.argv
-debye_max = float(parse(sys.argv, '-debye_max', .5))
-debye_dist = float(parse(sys.argv, '-debye_dist', 1.))
-debye_n = int(parse(sys.argv, '-debye_n', 51))
-if (number > 1) and not surface:
-    print("Simulating more than one chain without a surface makes no sense!\n")
-    exit()
-
-# start the timer and initialize the Chains instance
-t0 = time.time()
-initialConf = {False: None, True: outputFile + '.pdb'}[append]
-chains = Chains.Chains(
-    number=number, length=length, box=box, maxAngle=maxAngle, beta=beta,
-    surface=surface, outFile=outputFile + '.pdb', initialConf=initialConf,
-    grid=grid,
-)
-
-# set up the output
-fp = open(outputFile + '.commandLine', 'w')
-for s in sys.argv:
-    fp.write(s + ' ')
-fp.write('\n')
-fp.close()
-fp = open(outputFile + '.traj', 'w')
-fp.write('Iteration\tBonds\tAverage angle')
-fp.close()
-if not append:
-    try:
-        os.remove(outputFile + '.pdb')
-    except:
-        pass
-    chains.dump(append=True)
-
-# do the simulation
-goodSteps, badSteps, oldBonds = 0, 0, 0
-if debye:
-    q = np.linspace(0, debye_max, debye_n)
-    Idebye = []
-for i in range(nSteps):
-    # Perturb and check new structure:
-    chains.randomRotation(1, stepsize)
-    bonds, angles = chains.check()
-    # Find time-dependent beta for simulated annealing:
+def annealedBeta(beta, steps, nSteps, ramps):
+    """
+    The inverse temperature at each of the <steps> for <ramps> simulated
+    annealing ramps up to <beta>, each followed by an equally long
+    plateau, over a total of <nSteps> steps.
+    """
+    steps = np.asarray(steps, dtype=float)
     if ramps == 0:
-        beta_ = chains.beta
-    else:
-        beta_ = chains.beta
-        if not (2 * i / (nSteps / (ramps))) % 2:
-            beta_ = chains.beta * (2 * i % (nSteps / ramps)) / (nSteps / ramps)
-    # Metropolis condition:
-    if bonds is None:
-        keep = False
-    elif ((oldBonds - bonds <= 0)
-          or (np.random.rand() < np.exp(-beta_ * (oldBonds - bonds)))):
-        keep = True
-    else:
-        keep = False
-    # Keep or restore:
-    if keep:
-        goodSteps += 1
-        oldBonds = bonds
+        return np.full(steps.shape, beta)
+    period = float(nSteps) / ramps
+    ramping = (2 * steps // period) % 2 == 0
+    return np.where(ramping, beta * (2 * steps % period) / period, beta)
+
+
+def parseArgs(argv):
+    """
+    Returns the settings on the command line <argv> as a dict of keyword
+    arguments for simulate().
+    """
+    if '-help' in argv:
+        usage()
+    opts = {}
+    opts['surface'] = '-surface' in argv
+    opts['append'] = '-append' in argv
+    number = parse(argv, '-number', '1')
+    if 'x' in number:
+        opts['grid'] = list(map(int, number.split('x')))
+        opts['number'] = opts['grid'][0] * opts['grid'][1]
     else:
-        chains.restorePrevious()
-        bonds = oldBonds
-        badSteps += 1
-    # output
-    i_ = i + 1
-    if (i_ % outputFreq == 0) or (i_ == nSteps):
+        opts['grid'] = None
+        opts['number'] = int(number)
+    opts['length'] = int(parse(argv, '-length', 50))
+    opts['box'] = float(parse(argv, '-box', 10))
+    opts['maxAngle'] = float(parse(argv, '-maxAngle', 90)) * np.pi / 180.0
+    opts['beta'] = float(parse(argv, '-beta', 0))
+    opts['stepsize'] = float(parse(argv, '-stepsize', 1.))
+    opts['moves'] = [float(parse(argv, '-' + name, int(name == 'pivot')))
+                     for name in Chains.MOVES]
+    opts['adapt'] = int(parse(argv, '-adapt', 0))
+    opts['target'] = float(parse(argv, '-target', .3))
+    opts['ramps'] = int(parse(argv, '-ramps', 0))
+    opts['outputFile'] = parse(argv, '-outputFile', 'out')
+    opts['outputFreq'] = int(parse(argv, '-outputFreq', 10))
+    opts['nSteps'] = int(parse(argv, '-steps', 1000))
+    opts['debye'] = '-debye' in argv
+    opts['debye_max'] = float(parse(argv, '-debye_max', .5))
+    opts['debye_dist'] = float(parse(argv, '-debye_dist', 1.))
+    opts['debye_n'] = int(parse(argv, '-debye_n', 51))
+    opts['debye_exact'] = '-debye_exact' in argv
+    opts['debye_burnin'] = int(parse(argv, '-debye_burnin', 0))
+    opts['debye_blocks'] = int(parse(argv, '-debye_blocks', 0))
+    opts['debye_flush'] = int(parse(argv, '-debye_flush', 100))
+    opts['debye_stream'] = '-debye_stream' in argv
+    seed = parse(argv, '-seed', None)
+    opts['seed'] = None if seed is None else int(seed)
+    opts['backend'] = parse(argv, '-backend', 'numpy')
+    opts['trajFormat'] = parse(argv, '-format', 'pdb')
+    opts['checkpointFreq'] = int(parse(argv, '-checkpoint', 0))
+    opts['resume'] = '-resume' in argv
+    opts['profileFreq'] = int(parse(argv, '-profile', 0))
+    opts['observables'] = '-observables' in argv
+    opts['bufferSize'] = int(float(parse(argv, '-buffer', 1024)) * 1024)
+    opts['flushTime'] = float(parse(argv, '-flushTime', 5))
+    if opts['backend'] not in ('numpy', 'numba'):
+        print('Unknown backend "%s", use "numpy" or "numba"!\n'
+              % opts['backend'])
+        exit()
+    if opts['trajFormat'] not in ('pdb', 'bin'):
+        print('Unknown trajectory format "%s", use "pdb" or "bin"!\n'
+              % opts['trajFormat'])
+        exit()
+    if opts['backend'] == 'numba' and not kernels.HAVE_NUMBA:
+        print("Numba isn't installed, using the numpy backend instead.")
+        opts['backend'] = 'numpy'
+    if opts['backend'] == 'numba' and any(opts['moves'][1:]):
+        print("The numba backend only makes pivot moves, using the numpy "
+              "backend instead.")
+        opts['backend'] = 'numpy'
+    if (opts['number'] > 1) and not opts['surface']:
+        print("Simulating more than one chain without a surface makes no "
+              "sense!\n")
+        exit()
+    if opts['moves'][3] and not opts['surface']:
+        print("Shift moves are only for chains grafted on a surface!\n")
+        exit()
+    if opts['moves'][1] and opts['length'] < 3:
+        print("Crankshaft moves need chains of at least three beads!\n")
+        exit()
+    return opts
+
+
+class Simulation(object):
+    def __init__(self, number=1, length=50, box=10., maxAngle=np.pi / 2,
+                 beta=0., stepsize=1., moves=(1, 0, 0, 0), adapt=0,
+                 target=.3, ramps=0, outputFile='out',
+                 outputFreq=10, nSteps=1000, surface=False, grid=None,
+                 append=False, debye=False, debye_max=.5, debye_dist=1.,
+                 debye_n=51, debye_exact=False, debye_burnin=0,
+                 debye_blocks=0, debye_flush=100, debye_stream=False,
+                 seed=None, backend='numpy',
+                 trajFormat='pdb', checkpointFreq=0, resume=False,
+                 profileFreq=0, observables=False,
+                 bufferSize=writers.BUFFER_SIZE, flushTime=writers.FLUSH_TIME,
+                 commandLine='', progress=None):
+        """
+        Set up a simulation with the settings described in usage(), and
+        start its output files. On every progress report,
+        <progress>(step, nSteps, beta) is called if given, otherwise a
+        progress line is printed.
+        Raises ValueError if the weights of the <moves> are negative or
+        all zero, or if shift moves are given a weight without a surface.
+        """
+        weights = np.array(moves, dtype=float)
+        if ((weights.shape != (len(Chains.MOVES),)) or np.any(weights < 0)
+                or not np.any(weights > 0)):
+            raise ValueError('The moves need non-negative weights, not all '
+                             'zero, for each of %s' % ', '.join(Chains.MOVES))
+        if weights[3] and not surface:
+            raise ValueError('Shift moves are only for grafted chains')
+        # the moves with a weight, and the cumulative weights to pick one
+        self.kinds = np.flatnonzero(weights)
+        self.cumWeights = np.cumsum(weights[self.kinds])
+        self.adapt, self.target = adapt, target
+        # the step size of each move, with its tried and accepted steps
+        # overall and since the size was last adapted
+        self.sizes = np.full(len(Chains.MOVES), float(stepsize))
+        self.counts = np.zeros((len(Chains.MOVES), 2), dtype=int)
+        self.tuning = np.zeros((len(Chains.MOVES), 2), dtype=int)
+        self.ramps = ramps
+        self.outputFile, self.outputFreq = outputFile, outputFreq
+        self.nSteps, self.surface = nSteps, surface
+        self.debye, self.debye_dist = debye, debye_dist
+        self.debye_exact = debye_exact
+        self.debye_burnin, self.debye_flush = debye_burnin, debye_flush
+        self.debye_stream = debye_stream
+        self.backend, self.progress = backend, progress
+        self.trajFormat, self.checkpointFreq = trajFormat, checkpointFreq
+        self.profileFreq, self.observables = profileFreq, observables
+        self.timer, self.lap = None, profiling.skip
+        if profileFreq:
+            self.timer = profiling.Timer()
+            self.lap = self.timer.lap
+        if seed is not None:
+            np.random.seed(seed)
+
+        # start the timer and initialize the Chains instance
+        self.t0 = time.time()
+        initialConf = None
+        if append:
+            initialConf = outputFile + '.' + trajFormat
+        self.chains = Chains.Chains(
+            number=number, length=length, box=box, maxAngle=maxAngle,
+            beta=beta, surface=surface, outFile=outputFile + '.pdb',
+            initialConf=initialConf, grid=grid,
+        )
+
+        self.goodSteps, self.i_ = 0, 0
+        self.chains.check()
+        if debye:
+            self.q = np.linspace(0, debye_max, debye_n)
+            self.Idebye, self.frames = [], []
+            self.accumulator = scattering.DebyeAccumulator(self.q,
+                                                           debye_blocks)
+            self.histogram = scattering.PairHistogram(len(self.chains.beads))
+
+        # set up the output
+        with open(outputFile + '.commandLine', 'w') as fp:
+            fp.write(commandLine + '\n')
+        if resume:
+            self.restore()
+        else:
+            with open(outputFile + '.traj', 'w') as fp:
+                fp.write('Iteration\tBonds\tAverage angle')
+            if observables:
+                with open(outputFile + '.obs', 'w') as fp:
+                    fp.write('\t'.join(structure.COLUMNS) + '\n')
+        self.i0 = self.i_
+        # the trajectory and .traj files stay open until finish()
+        if trajFormat == 'bin':
+            self.writer = trajectory.TrajectoryWriter(
+                outputFile + '.bin', number, length, append=append or resume,
+                bufferSize=bufferSize, flushTime=flushTime)
+            if not (append or resume):
+                self.writer.write(self.chains.coords, 0)
+        else:
+            mode = 'a' if (append or resume) else 'w'
+            self.writer = writers.BufferedWriter(outputFile + '.pdb', mode,
+                                                 bufferSize, flushTime)
+            if not (append or resume):
+                self.writer.write(trajectory.pdbFrame(self.chains.coords))
+        self.log = writers.BufferedWriter(outputFile + '.traj', 'a',
+                                          bufferSize, flushTime)
+        self.obs = None
+        if observables:
+            self.obs = writers.BufferedWriter(outputFile + '.obs', 'a',
+                                              bufferSize, flushTime)
+        if profileFreq:
+            if not (append or resume):
+                open(outputFile + '.prof', 'w').close()
+            self.window = (self.i_, self.goodSteps, time.time(),
+                           self.outputSize())
+
+    def run(self, steps=None):
+        """
+        Runs <steps> more steps, or all remaining ones, in batches which
+        end at the next progress report or at the next output.
+        """
+        chains, outputFreq, nSteps = self.chains, self.outputFreq, self.nSteps
+        lap, profileFreq = self.lap, self.profileFreq
+        end = nSteps if steps is None else min(self.i_ + steps, nSteps)
+        lap()
+        while self.i_ < end:
+            # Random numbers for the moves and the Metropolis condition,
+            # and the time-dependent beta for simulated annealing. With
+            # other moves than pivots, an extra column picks the move:
+            i_ = self.i_
+            k = min(outputFreq - i_ % outputFreq, end - i_)
+            if list(self.kinds) == [0]:
+                draws = np.random.rand(k, 6)
+                moves, size = None, self.sizes[0]
+            else:
+                draws = np.random.rand(k, 7)
+                moves = self.kinds[np.searchsorted(
+                    self.cumWeights[:-1], draws[:, 6] * self.cumWeights[-1],
+                    side='right')]
+                size = self.sizes
+            betas = annealedBeta(chains.beta, np.arange(i_, i_ + k), nSteps,
+                                 self.ramps)
+            lap('draws')
+            counts = np.zeros_like(self.counts)
+            goodSteps = self.goodSteps
+            steps_, self.goodSteps, output = chains.metropolis(
+                draws, betas, size, self.goodSteps, outputFreq,
+                self.backend, self.timer, moves,
+                None if moves is None else counts)
+            if moves is None:
+                counts[0] = steps_, self.goodSteps - goodSteps
+            self.i_ = i_ = i_ + steps_
+            self.tune(counts, i_ - steps_)
+            # output
+            if (i_ % outputFreq == 0) or (i_ == nSteps):
+                self.report(betas[steps_ - 1])
+                lap('report')
+            if output:
+                self.output()
+            if (self.checkpointFreq and i_ // self.checkpointFreq
+                    > (i_ - steps_) // self.checkpointFreq):
+                self.checkpoint()
+                lap('checkpoint')
+            if profileFreq and ((i_ // profileFreq > (i_ - steps_)
+                                 // profileFreq) or (i_ == nSteps)):
+                self.profile()
+                lap('profile')
+
+    def tune(self, counts, start):
+        """
+        Adds the tried and accepted steps <counts> of each move, from
+        step <start> on. Before step <adapt>, the step size of each move
+        tried ADAPT_TRIES times since its last change is then multiplied
+        by exp(rate - <target>) for its acceptance rate since then.
+        """
+        self.counts += counts
+        if start >= self.adapt:
+            return
+        self.tuning += counts
+        due = self.tuning[:, 0] >= ADAPT_TRIES
+        rate = self.tuning[due, 1] / self.tuning[due, 0].astype(float)
+        self.sizes[due] = np.clip(self.sizes[due] * np.exp(rate - self.target),
+                                  *STEPSIZE_RANGE)
+        self.tuning[due] = 0
+        if self.i_ >= self.adapt and self.progress is None:
+            print('   step sizes adapted to ' + ', '.join(
+                '%s %.3g' % (Chains.MOVES[kind], self.sizes[kind])
+                for kind in self.kinds))
+
+    def report(self, beta_):
+        i_, nSteps = self.i_, self.nSteps
+        if self.progress is not None:
+            self.progress(i_, nSteps, beta_)
+            return
         t = time.time()
         betaText = ''
-        if ramps:
+        if self.ramps:
             betaText = ', beta=%.2f' % beta_
-        remaining = float(nSteps - i_) * ((t - t0)) / i_
+        remaining = float(nSteps - i_) * ((t - self.t0)) / (i_ - self.i0)
         if remaining < 300:
             timeString = '%.1fs' % remaining
         else:
             timeString = '%.0fmin' % (remaining // 60,)
         print('   step %d/%d: %.1fs, %s remaining'
-              % (i_, nSteps, t - t0, timeString) + betaText)
-    if keep and (goodSteps % outputFreq == 0):
-        chains.dump(append=True)
-        with open(outputFile + '.traj', 'a') as fp:
-            fp.write('%u\t%u\t%f\n' % (goodSteps, bonds, np.mean(angles)))
-        if debye:
-            Idebye.append(chains.debye(q * debye_dist))
-
-if debye:
-    np.savez(outputFile + '.npz', q=q, I=np.array(Idebye))
-
-# fix a nice vmd file for this simulation
-with open(outputFile + '.vmd', 'w') as fout:
-    abspath = os.path.dirname(os.path.realpath(__file__))
-    with open(abspath + '/base.vmd', 'r') as fin:
-        for line in fin:
-            fout.write(line.replace('_FILENAME_', outputFile + '.pdb'))
-        if not surface:
-            fout.write('\nsource %s/align_traj.tcl \nalign_traj_on_itself '
-                       '0 "all" 0\n' % abspath)
-
-t = time.time()
-if t - t0 < 300:
-    timeText = '%.1fs' % (t - t0)
-else:
-    timeText = '%.0fmin' % ((t - t0) / 60)
-print('\nSimulation done in ' + timeText)
-print('Trajectory written to %s.pdb' % outputFile)
-print('Visualization state saved as %s.vmd, do "vmd -e %s.vmd" to look'
-      % ((outputFile,) * 2))
-if nSteps > 0:
-    print('Acceptance rate: %.1f%%' % (100 * float(goodSteps) / nSteps))
+              % (i_, nSteps, t - self.t0, timeString) + betaText)
+
+    def output(self):
+        chains, lap = self.chains, self.lap
+        if self.trajFormat == 'bin':
+            self.writer.write(chains.coords, self.goodSteps)
+        else:
+            self.writer.write(trajectory.pdbFrame(chains.coords))
+        lap('dump')
+        self.log.write('%u\t%u\t%f\n' % (self.goodSteps, chains.bonds,
+                                         np.mean(chains.angles)))
+        lap('traj')
+        if self.observables:
+            self.obs.write('%u\t%f\t%f\t%f\t%u\t%u\n'
+                           % ((self.goodSteps,) + structure.compute(chains)))
+            lap('observables')
+        if self.debye:
+            counts = scattering.histogram(chains.beads)
+            if self.debye_exact:
+                I = chains.debye(self.q * self.debye_dist, exact=True)
+            else:
+                I = scattering.fromHistogram(counts, len(chains.beads),
+                                             self.q * self.debye_dist)
+            if not self.debye_stream:
+                self.Idebye.append(I)
+                self.frames.append(self.goodSteps)
+            if self.goodSteps >= self.debye_burnin:
+                self.accumulator.add(I)
+                self.histogram.add(counts)
+                if self.accumulator.n % self.debye_flush == 0:
+                    self.accumulator.save(self.outputFile + '.debye')
+                    self.histogram.save(self.outputFile + '.hist')
+            lap('debye')
+
+    def outputSize(self):
+        """
+        The total size of the trajectory and .traj files.
+        """
+        self.writer.flush()
+        self.log.flush()
+        return sum(os.path.getsize(self.outputFile + '.' + ext)
+                   for ext in ('traj', self.trajFormat))
+
+    def outputs(self):
+        """
+        The extensions of the files which output() appends to.
+        """
+        return ('traj', self.trajFormat) + (('obs',) if self.observables
+                                            else ())
+
+    def profile(self):
+        """
+        Appends the seconds spent in each part of the loop, the steps
+        and accepted steps, and the bytes of trajectory written since
+        the last call as a JSON line to <outputFile>.prof.
+        """
+        step, goodSteps, t, size = self.window
+        self.window = (self.i_, self.goodSteps, time.time(),
+                       self.outputSize())
+        steps, accepted = self.i_ - step, self.goodSteps - goodSteps
+        record = dict(step=self.i_, goodSteps=self.goodSteps, steps=steps,
+                      accepted=accepted,
+                      acceptance=float(accepted) / max(steps, 1),
+                      wall=self.window[2] - t,
+                      seconds=self.timer.pop(),
+                      bytes=self.window[3] - size)
+        with open(self.outputFile + '.prof', 'a') as fp:
+            fp.write(json.dumps(record) + '\n')
+
+    def checkpoint(self):
+        """
+        Saves everything needed to continue the simulation exactly, with
+        the sizes of the output files so far, to <outputFile>.chk.
+        """
+        outputFile = self.outputFile
+        self.writer.flush()
+        self.log.flush()
+        if self.obs is not None:
+            self.obs.flush()
+        coords, bonds, angles = self.chains.state()
+        if bonds is None:
+            bonds, angles = -1, np.zeros(0)
+        keys, pos, hasGauss, gauss = np.random.get_state()[1:]
+        state = dict(coords=coords, bonds=bonds, angles=angles,
+                     goodSteps=self.goodSteps, step=self.i_, sizes=self.sizes,
+                     counts=self.counts, tuning=self.tuning, rng_keys=keys,
+                     rng_pos=pos, rng_has_gauss=hasGauss, rng_gauss=gauss)
+        for ext in self.outputs():
+            state['size_' + ext] = os.path.getsize(outputFile + '.' + ext)
+        if self.debye:
+            state.update(I=np.array(self.Idebye).reshape((-1, len(self.q))),
+                         frames=np.array(self.frames, dtype=int))
+            for key, value in self.accumulator.state().items():
+                state['acc_' + key] = value
+            for key, value in self.histogram.state().items():
+                state['hist_' + key] = value
+        # write to a temporary file first so that a crash can't leave a
+        # broken checkpoint behind
+        with open(outputFile + '.chk.tmp', 'wb') as fp:
+            np.savez(fp, **state)
+        os.replace(outputFile + '.chk.tmp', outputFile + '.chk')
+
+    def restore(self):
+        """
+        Continues from <outputFile>.chk, cutting the output files back to
+        where they were when it was written.
+        """
+        outputFile = self.outputFile
+        print('Resuming from the checkpoint %s.chk.' % outputFile)
+        chk = np.load(outputFile + '.chk')
+        for ext in self.outputs():
+            os.truncate(outputFile + '.' + ext, int(chk['size_' + ext]))
+        bonds, angles = int(chk['bonds']), chk['angles']
+        if bonds < 0:
+            bonds, angles = None, None
+        self.chains.setState((chk['coords'], bonds, angles))
+        self.goodSteps, self.i_ = int(chk['goodSteps']), int(chk['step'])
+        self.sizes, self.counts = chk['sizes'], chk['counts']
+        self.tuning = chk['tuning']
+        if self.debye:
+            self.Idebye, self.frames = list(chk['I']), list(chk['frames'])
+            self.accumulator = scattering.DebyeAccumulator.fromState(
+                {key[4:]: chk[key] for key in chk.files
+                 if key.startswith('acc_')})
+            self.histogram = scattering.PairHistogram.fromState(
+                {key[5:]: chk[key] for key in chk.files
+                 if key.startswith('hist_')})
+        np.random.set_state(('MT19937', chk['rng_keys'], int(chk['rng_pos']),
+                             int(chk['rng_has_gauss']),
+                             float(chk['rng_gauss'])))
+
+    def finish(self):
+        """
+        Writes the final output files. Returns a dict with the number of
+        accepted steps, the step size of each move with its tried and
+        accepted steps, and with debye also the q values, the mean and
+        error of the Debye curves after the burn-in, the number of
+        frames averaged and their summed pair distance histogram, see
+        scattering.PairHistogram. Unless streaming, the Debye curves of
+        all output frames and the number of accepted steps at each of
+        them are included too.
+        """
+        outputFile = self.outputFile
+        self.writer.close()
+        self.log.close()
+        if self.obs is not None:
+            self.obs.close()
+        result = {'goodSteps': self.goodSteps, 'sizes': self.sizes.copy(),
+                  'counts': self.counts.copy()}
+        if self.debye:
+            acc = self.accumulator
+            acc.save(outputFile + '.debye')
+            self.histogram.save(outputFile + '.hist')
+            result.update(q=self.q, mean=acc.mean, error=acc.error, n=acc.n,
+                          histogram=self.histogram)
+            if not self.debye_stream:
+                np.savez(outputFile + '.npz', q=self.q,
+                         I=np.array(self.Idebye),
+                         frames=np.array(self.frames, dtype=int))
+                result.update(I=np.array(self.Idebye),
+                              frames=np.array(self.frames))
+
+        # fix a nice vmd file for this simulation
+        with open(outputFile + '.vmd', 'w') as fout:
+            abspath = os.path.dirname(os.path.realpath(__file__))
+            with open(abspath + '/base.vmd', 'r') as fin:
+                for line in fin:
+                    fout.write(line.replace('_FILENAME_', outputFile + '.pdb'))
+                if not self.surface:
+                    fout.write('\nsource %s/align_traj.tcl \n'
+                               'align_traj_on_itself 0 "all" 0\n' % abspath)
+        return result
+
+
+def simulate(**kwargs):
+    """
+    Runs a whole simulation, see Simulation, and returns the result of
+    Simulation.finish().
+    """
+    sim = Simulation(**kwargs)
+    sim.run()
+    return sim.finish()
+
+
+def main(argv):
+    opts = parseArgs(argv)
+    writers.handleSignals()
+    t0 = time.time()
+    # settings which can't be simulated, like more chains than fit on
+    # the surface, are reported like the other bad settings
+    try:
+        sim = Simulation(commandLine=' '.join(argv) + ' ', **opts)
+    except ValueError as e:
+        print('%s\n' % e)
+        exit()
+    sim.run()
+    result = sim.finish()
+    outputFile, nSteps = opts['outputFile'], opts['nSteps']
+
+    t = time.time()
+    if t - t0 < 300:
+        timeText = '%.1fs' % (t - t0)
+    else:
+        timeText = '%.0fmin' % ((t - t0) / 60)
+    print('\nSimulation done in ' + timeText)
+    if opts['trajFormat'] == 'bin':
+        print('Trajectory written to %s.bin, do "python trajectory.py %s.bin '
+              '%s.pdb" for vmd' % ((outputFile,) * 3))
+    else:
+        print('Trajectory written to %s.pdb' % outputFile)
+    print('Visualization state saved as %s.vmd, do "vmd -e %s.vmd" to look'
+          % ((outputFile,) * 2))
+    if nSteps > 0:
+        print('Acceptance rate: %.1f%%'
+              % (100 * float(result['goodSteps']) / nSteps))
+        if any(opts['moves'][1:]):
+            print('Acceptance rate per move: ' + ', '.join(
+                '%s %.1f%%' % (name, 100 * float(accepted) / tried)
+                for name, (tried, accepted)
+                in zip(Chains.MOVES, result['counts']) if tried))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,129 @@
+"""
+Script which runs an ensemble of independent simulations over a pool of
+processes, and averages their Debye curves after a burn-in period.
+"""
+
+import numpy as np
+import multiprocessing
+import os
+import time
+import sys
+import chainSimulation
+
+
+def usage():
+    msg = (
+        '\nUsage:\n\n'
+        'ensemble.py [options] <chainSimulation.py options>\n\n'
+        '  -runs <n>:        number of independent trajectories, written to\n'
+        '                    <outputFile>1, <outputFile>2, ... (default 20)\n'
+        '  -procs <n>:       number of processes to run them on (default\n'
+        '                    the number of cores)\n'
+        '  -burnin <n>:      number of accepted steps to discard from each\n'
+        '                    trajectory before averaging, the same as\n'
+        '                    -debye_burnin (default 0)\n\n'
+        'Run i is seeded with <seed> + i if -seed is given. With -debye, the\n'
+        'mean Debye curve over all runs is written to <outputFile>.mean,\n'
+        'with the standard error of the mean over runs.\n'
+    )
+    print(msg)
+    exit()
+
+
+def runArgv(argv, outputFile, seed):
+    """
+    The command line <argv> with the output file and seed of one run.
+    """
+    argv = list(argv)
+    for key, value in (('-outputFile', outputFile), ('-seed', str(seed))):
+        if key in argv:
+            argv[argv.index(key) + 1] = value
+        else:
+            argv += [key, value]
+    return argv
+
+
+def runOne(job):
+    """
+    Runs one simulation of the ensemble in a pool process, reporting its
+    progress through the queue.
+    """
+    i, opts, commandLine, queue = job
+
+    def progress(step, nSteps, beta):
+        queue.put((i, step))
+
+    return chainSimulation.simulate(commandLine=commandLine,
+                                    progress=progress, **opts)
+
+
+def main(argv):
+    if '-help' in argv:
+        usage()
+    runs = int(chainSimulation.parse(argv, '-runs', 20))
+    procs = int(chainSimulation.parse(argv, '-procs', os.cpu_count()))
+    opts = chainSimulation.parseArgs(argv)
+    burnin = int(chainSimulation.parse(argv, '-burnin', opts['debye_burnin']))
+    if '-debye_burnin' in argv and burnin != opts['debye_burnin']:
+        print("-burnin and -debye_burnin disagree, give only one of them!\n")
+        exit()
+    opts['debye_burnin'] = burnin
+    outputFile, nSteps, seed = (opts['outputFile'], opts['nSteps'],
+                                opts['seed'])
+    if seed is None:
+        seeds = np.random.randint(2 ** 31, size=runs)
+    else:
+        seeds = seed + np.arange(1, runs + 1)
+
+    manager = multiprocessing.Manager()
+    queue = manager.Queue()
+    jobs = []
+    for i in range(1, runs + 1):
+        opts_ = dict(opts, outputFile=outputFile + str(i),
+                     seed=int(seeds[i - 1]))
+        argv_ = runArgv(argv, opts_['outputFile'], opts_['seed'])
+        jobs.append((i, opts_, ' '.join(argv_) + ' ', queue))
+
+    # run the ensemble and report the total progress
+    t0 = time.time()
+    done = np.zeros(runs + 1, dtype=int)
+    with multiprocessing.Pool(min(procs, runs)) as pool:
+        async_ = pool.map_async(runOne, jobs)
+        while not async_.ready():
+            async_.wait(2)
+            while not queue.empty():
+                i, step = queue.get()
+                done[i] = step
+            t = time.time()
+            total = done.sum()
+            if total:
+                remaining = float(runs * nSteps - total) * (t - t0) / total
+                print('   %d/%d steps in %d runs: %.1fs, %.0fs remaining'
+                      % (total, runs * nSteps, runs, t - t0, remaining))
+        results = async_.get()
+
+    print('\nEnsemble of %d runs done in %.1fs' % (runs, time.time() - t0))
+    print('Acceptance rate: %.1f%%'
+          % (100 * float(sum(r['goodSteps'] for r in results))
+             / max(runs * nSteps, 1)))
+    if opts['debye']:
+        done = [r for r in results if r['n']]
+        curves = np.array([r['mean'] for r in done])
+        if not len(curves):
+            print('No frames after the burn-in, no mean Debye curve.')
+            return
+        q = results[0]['q']
+        mean = np.mean(curves, axis=0)
+        # the standard error over the runs, or of the only one
+        if len(curves) >= 2:
+            err = np.std(curves, axis=0, ddof=1) / np.sqrt(len(curves))
+        else:
+            err = done[0]['error']
+        np.savetxt(outputFile + '.mean', np.vstack((q, mean, err)).T,
+                   header='%d runs, burn-in %d accepted steps\nq\tI\terror'
+                   % (len(curves), burnin))
+        print('Mean Debye curve written to %s.mean' % outputFile)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,108 @@
+"""
+Fitting of simulated scattering curves to the SAXS data. Model curves
+are interpolated onto the experimental q grid once, after which the
+scale factor and flat background of every model against every data set
+follow from weighted linear least squares in closed form, so that whole
+ensembles of runs can be scored against several samples at once.
+"""
+
+import numpy as np
+import os
+
+
+def interpolation(qModel, qData):
+    """
+    Returns the indices and weights which linearly interpolate curves
+    sampled at <qModel> onto <qData>, for use with interpolate(). Points
+    outside the model range take the value at its closest end.
+    """
+    qData = np.clip(qData, qModel[0], qModel[-1])
+    idx = np.clip(np.searchsorted(qModel, qData) - 1, 0, len(qModel) - 2)
+    w = (qData - qModel[idx]) / (qModel[idx + 1] - qModel[idx])
+    return idx, w
+
+
+def interpolate(curves, weights):
+    """
+    Interpolates <curves> (..., len(qModel)) onto the data grid, with
+    <weights> from interpolation().
+    """
+    idx, w = weights
+    curves = np.asarray(curves)
+    return curves[..., idx] * (1 - w) + curves[..., idx + 1] * w
+
+
+def linearFit(model, I, err, background=True):
+    """
+    Solves I = scale * model + background in the least squares sense
+    with weights 1/err**2. The arguments broadcast against each other
+    along all but the last axis, which is q, so that for example models
+    of shape (runs, 1, n) and data of shape (samples, n) give one fit
+    per run and sample. Without <background> it is fixed at zero.
+    Returns scale, background and chi squared per degree of freedom.
+    """
+    w = 1 / np.asarray(err) ** 2
+    Sw = np.sum(w, axis=-1)
+    Sm = np.sum(w * model, axis=-1)
+    Smm = np.sum(w * model ** 2, axis=-1)
+    Sy = np.sum(w * I, axis=-1)
+    Smy = np.sum(w * model * I, axis=-1)
+    if background:
+        det = Sw * Smm - Sm ** 2
+        scale = (Sw * Smy - Sm * Sy) / det
+        bg = (Smm * Sy - Sm * Smy) / det
+    else:
+        scale = Smy / Smm
+        bg = np.zeros_like(scale)
+    residual = I - scale[..., None] * model - bg[..., None]
+    dof = np.shape(residual)[-1] - (2 if background else 1)
+    chi2 = np.sum(w * residual ** 2, axis=-1) / dof
+    return scale, bg, chi2
+
+
+def fit(qModel, curves, qData, I, err, formFactor=None, qRange=None,
+        background=True):
+    """
+    Fits the model <curves> (runs, len(qModel)), optionally multiplied
+    by <formFactor> on the same grid, to the data sets <I> and <err>
+    (samples, len(qData)) as returned by saxsData.loadMany(), using the
+    data points within <qRange> = (qmin, qmax) if given. Returns a dict
+    with scale, background and chi2 of shape (runs, samples), and the
+    interpolated model on the data grid.
+    """
+    curves = np.atleast_2d(curves)
+    if formFactor is not None:
+        curves = curves * formFactor
+    model = interpolate(curves, interpolation(qModel, qData))
+    I, err = np.atleast_2d(I), np.atleast_2d(err)
+    mask = slice(None)
+    if qRange is not None:
+        mask = (qData >= qRange[0]) & (qData <= qRange[1])
+    scale, bg, chi2 = linearFit(model[:, None, mask], I[None, :, mask],
+                                err[None, :, mask], background)
+    return {'scale': scale, 'background': bg, 'chi2': chi2, 'model': model}
+
+
+def loadRuns(directory, start=0):
+    """
+    Reads the runs <name>.npz and <name>.traj in <directory>, written by
+    chainSimulation.py with -debye, and averages the Debye curves of
+    each from accepted step <start> on. Returns the run names, q, the
+    mean curves (runs, len(q)) and the step, bond and angle columns of
+    each trajectory.
+    """
+    runs = sorted(n[:-4] for n in os.listdir(directory) if n.endswith('.npz'))
+    curves, trajs = [], []
+    for run in runs:
+        traj = np.loadtxt(os.path.join(directory, run + '.traj'), skiprows=1)
+        dct = np.load(os.path.join(directory, run + '.npz'))
+        q, I = dct['q'], dct['I']
+        if 'frames' in dct:
+            frames = dct['frames']
+        else:
+            # older runs, whose first trajectory line shares the header
+            I = I[-len(traj):]
+            frames = traj[:, 0]
+        curves.append(np.mean(I[frames >= start], axis=0))
+        trajs.append(traj.T)
+    return runs, q, np.array(curves), trajs
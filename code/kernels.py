@@ -0,0 +1,129 @@
+"""
+Optional compiled kernels for the Monte Carlo loop. With Numba
+installed, pivotSteps() runs a whole batch of pivot moves, checks and
+Metropolis decisions on the coordinate array without returning to
+Python. It makes the same decisions as the numpy code in
+Chains.metropolis() for the same random numbers, up to rounding, so the
+two backends can be checked against each other. Without Numba the
+kernels are plain (and slow) Python functions.
+"""
+
+import numpy as np
+
+try:
+    import numba
+    HAVE_NUMBA = True
+    jit = numba.njit(cache=True)
+except ImportError:
+    HAVE_NUMBA = False
+
+    def jit(f):
+        return f
+
+
+@jit
+def rotationMatrix(rot, tX, tY, tZ):
+    """
+    Fills <rot> with the matrix of Chains.rotationMatrix().
+    """
+    cX, sX = np.cos(tX), np.sin(tX)
+    cY, sY = np.cos(tY), np.sin(tY)
+    cZ, sZ = np.cos(tZ), np.sin(tZ)
+    rot[0, 0] = cY * cZ
+    rot[0, 1] = -cY * sZ
+    rot[0, 2] = sY
+    rot[1, 0] = sX * sY * cZ + cX * sZ
+    rot[1, 1] = -sX * sY * sZ + cX * cZ
+    rot[1, 2] = -sX * cY
+    rot[2, 0] = -cX * sY * cZ + sX * sZ
+    rot[2, 1] = cX * sY * sZ + sX * cZ
+    rot[2, 2] = cX * cY
+
+
+@jit
+def distance(a, b):
+    return np.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2
+                   + (a[2] - b[2]) ** 2)
+
+
+@jit
+def pivotSteps(coords, angles, bonds, draws, betas, maxAngle, thetaMax,
+               surface, box, goodSteps, outputFreq):
+    """
+    Compiled version of the numpy loop in Chains.metropolis(), working
+    in place on the (number, length, 3) <coords> and the bend <angles>
+    of a valid configuration with <bonds> bonds. <thetaMax> is the
+    largest rotation angle of the pivot moves. Returns the number of
+    steps run, the new number of accepted steps, the new bond count
+    and whether output is due.
+    """
+    number, length = coords.shape[0], coords.shape[1]
+    saved = np.empty((length, 3))
+    rot = np.empty((3, 3))
+    for j in range(draws.shape[0]):
+        m = int(draws[j, 0] * number)
+        n = int(draws[j, 1] * (length - 1))
+        first = n + 2
+        newBonds = bonds
+        angle = 0.0
+        ok = True
+        if first < length:
+            rotationMatrix(rot, (1 - 2 * draws[j, 2]) * thetaMax,
+                           (1 - 2 * draws[j, 3]) * thetaMax,
+                           (1 - 2 * draws[j, 4]) * thetaMax)
+            origin = coords[m, n + 1]
+            for i in range(first, length):
+                saved[i] = coords[m, i]
+                for c in range(3):
+                    coords[m, i, c] = origin[c] + (
+                        rot[c, 0] * (saved[i, 0] - origin[0])
+                        + rot[c, 1] * (saved[i, 1] - origin[1])
+                        + rot[c, 2] * (saved[i, 2] - origin[2]))
+            # the angle at the pivot
+            a = coords[m, n + 2] - coords[m, n + 1]
+            b = coords[m, n + 1] - coords[m, n]
+            cos = (a[0] * b[0] + a[1] * b[1] + a[2] * b[2]) / (
+                np.sqrt(a[0] ** 2 + a[1] ** 2 + a[2] ** 2)
+                * np.sqrt(b[0] ** 2 + b[1] ** 2 + b[2] ** 2))
+            angle = np.arccos(min(1.0, max(-1.0, cos)))
+            ok = angle <= maxAngle
+            # surface and box violations
+            for i in range(first, length):
+                if not ok:
+                    break
+                r = coords[m, i]
+                if surface and r[2] < 0.5:
+                    ok = False
+                if box and (r[0] < 0 or r[0] > box
+                            or r[1] < 0 or r[1] > box):
+                    ok = False
+            # overlaps and bonds with the fixed beads
+            for k in range(number):
+                if not ok:
+                    break
+                end = n + 1 if k == m else length
+                for l in range(end):
+                    if not ok:
+                        break
+                    for i in range(first, length):
+                        dNew = distance(coords[m, i], coords[k, l])
+                        if dNew < 1.0:
+                            ok = False
+                            break
+                        if dNew < 1.2:
+                            newBonds += 1
+                        if distance(saved[i], coords[k, l]) < 1.2:
+                            newBonds -= 1
+        keep = ok and ((bonds - newBonds <= 0) or (
+            draws[j, 5] < np.exp(-betas[j] * (bonds - newBonds))))
+        if keep:
+            goodSteps += 1
+            bonds = newBonds
+            if first < length:
+                angles[m, n] = angle
+            if goodSteps % outputFreq == 0:
+                return j + 1, goodSteps, bonds, True
+        else:
+            for i in range(first, length):
+                coords[m, i] = saved[i]
+    return draws.shape[0], goodSteps, bonds, False
@@ -0,0 +1,37 @@
+"""
+Timing instrumentation for the simulation loop. A Timer splits the wall
+clock time into named sections by taking laps, so that the code being
+timed only needs one call at the end of each section.
+"""
+
+import time
+
+
+class Timer(object):
+    def __init__(self):
+        self.seconds = {}
+        self.last = time.perf_counter()
+
+    def lap(self, name=None):
+        """
+        Adds the time since the last lap to section <name>, or discards
+        it if <name> is None.
+        """
+        t = time.perf_counter()
+        if name is not None:
+            self.seconds[name] = self.seconds.get(name, 0.) + t - self.last
+        self.last = t
+
+    def pop(self):
+        """
+        Returns the seconds spent in each section since the last pop().
+        """
+        seconds, self.seconds = self.seconds, {}
+        return seconds
+
+
+def skip(name=None):
+    """
+    Stands in for Timer.lap() when not timing.
+    """
+    pass
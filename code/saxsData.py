@@ -0,0 +1,98 @@
+"""
+Loader for the rebinned SAXS data in data/RBNX_<num>_sub.dat. Each text
+file is parsed once into a binary sidecar <file>.npz next to it, which
+is used as long as the file's modification time and size, or failing
+that its SHA-1 hash, are unchanged. Parsed files are also kept in memory
+for repeated loads in the same process.
+"""
+
+import numpy as np
+import hashlib
+import os
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        os.pardir, 'data')
+PATTERN = 'RBNX_%d_sub.dat'
+HEADER_LINES = 3
+
+# concentration (g/ml) and dilution of each data set, see data/README.md
+SAMPLES = {
+    210: (5.01e-3, 1), 212: (5.01e-3, 2),
+    215: (7.31e-3, 1), 218: (7.31e-3, 2),
+    221: (7.14e-3, 1), 223: (7.14e-3, 2), 296: (7.14e-3, 4),
+    302: (7.14e-3, 10),
+    226: (12.2e-3, 1), 228: (12.2e-3, 2), 299: (12.2e-3, 4),
+    305: (12.2e-3, 10),
+}
+
+_memory = {}
+
+
+def _sha1(path):
+    with open(path, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def readFile(path, cache=True):
+    """
+    Returns the q, I and error columns of the data file <path> as an
+    (n, 3) array, from the binary cache if it is up to date.
+    """
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    if cache and path in _memory and _memory[path][0] == stamp:
+        return _memory[path][1]
+    sidecar = path + '.npz'
+    data = None
+    if cache and os.path.exists(sidecar):
+        with np.load(sidecar) as npz:
+            if tuple(npz['stamp']) == stamp:
+                data = npz['data']
+            elif str(npz['sha1']) == _sha1(path):
+                # touched but not changed, just renew the stamp
+                data = npz['data']
+                np.savez(sidecar, data=data, stamp=stamp, sha1=npz['sha1'])
+    if data is None:
+        data = np.loadtxt(path, skiprows=HEADER_LINES)[:, :3]
+        if cache:
+            np.savez(sidecar, data=data, stamp=stamp, sha1=_sha1(path))
+    if cache:
+        _memory[path] = (stamp, data)
+    return data
+
+
+def load(num, conc=None, dilution=None, background=0., cache=True):
+    """
+    Loads data set <num> normalized to absolute units per concentration:
+    I and its error are divided by <conc> / <dilution>, which default to
+    the values in SAMPLES, and a flat <background> is subtracted from I
+    afterwards. Returns an (n, 3) array of q, I and error.
+    """
+    conc_, dilution_ = SAMPLES.get(num, (1., 1))
+    conc = conc_ if conc is None else conc
+    dilution = dilution_ if dilution is None else dilution
+    data = readFile(os.path.join(DATA_DIR, PATTERN % num), cache).copy()
+    data[:, 1:] *= dilution / conc
+    data[:, 1] -= background
+    return data
+
+
+def loadMany(nums, conc=None, dilutions=None, background=0., cache=True):
+    """
+    Loads and normalizes several data sets as in load(), checking that
+    they share the same q grid. <conc> and <background> may be single
+    values or one per data set, and <dilutions> one per data set.
+    Returns q, and I and error as (len(nums), n) arrays.
+    """
+    k = len(nums)
+    conc = np.broadcast_to(np.array(conc, dtype=object), (k,))
+    dilutions = np.broadcast_to(np.array(dilutions, dtype=object), (k,))
+    background = np.broadcast_to(background, (k,))
+    data = np.array([load(num, conc[i], dilutions[i], background[i], cache)
+                     for i, num in enumerate(nums)])
+    q = data[0, :, 0]
+    for i, num in enumerate(nums):
+        if not np.allclose(data[i, :, 0], q):
+            raise ValueError('Data set %d has a different q grid than %d'
+                             % (num, nums[0]))
+    return q, data[:, :, 1], data[:, :, 2]
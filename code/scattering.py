@@ -0,0 +1,228 @@
+"""
+Debye scattering of bead models, either summed exactly over all bead
+pairs or from a histogram of the pair distances.
+
+The histogram version evaluates sin(qr)/(qr) once per occupied distance
+bin instead of once per pair. For a bin width w the sinc of each pair is
+evaluated at most w/2 from its true distance, which changes each term by
+less than about w / (2r). Since r >= 1 between beads, the default width
+of 0.002 bead diameters keeps the normalized intensity within 1e-3 of
+the exact sum. In practice the errors mostly cancel, and the deviation
+is a few times 1e-5.
+
+DebyeAccumulator averages Debye curves frame by frame during a run, and
+PairHistogram sums the pair distance histograms of the frames instead.
+Since the Debye sum is linear in the histogram, the latter gives the
+mean curve for any q grid and any scaling of the coordinates afterwards.
+"""
+
+import numpy as np
+import os
+
+# default width of the distance bins, in bead diameters
+BIN_WIDTH = 0.002
+# roughly the number of pair distances or sinc terms handled at once
+CHUNK = 2 ** 20
+
+
+def pairDistances(coords):
+    """
+    Returns the distances between all pairs of the (n, 3) points
+    <coords>, as a condensed array in the order i < j.
+    """
+    n = len(coords)
+    out = np.empty(n * (n - 1) // 2)
+    rows = max(1, CHUNK // max(n, 1))
+    k = 0
+    for a in range(0, n - 1, rows):
+        b = min(a + rows, n - 1)
+        d = np.linalg.norm(coords[a:b, None, :] - coords[None, a:, :],
+                           axis=-1)
+        d = d[np.triu_indices(b - a, 1, n - a)]
+        out[k:k + len(d)] = d
+        k += len(d)
+    return out
+
+
+def histogram(coords, width=BIN_WIDTH):
+    """
+    Returns the pair distance histogram of the points <coords>, as
+    counts in bins [k * width, (k + 1) * width).
+    """
+    return np.bincount((pairDistances(coords) / width).astype(int))
+
+
+def sincSum(r, q, weights=None):
+    """
+    Returns the (weighted) sum of sin(qr)/(qr) over the distances <r>,
+    for every q value.
+    """
+    res = np.zeros(len(q))
+    if weights is None:
+        weights = np.ones(len(r))
+    step = max(1, CHUNK // max(len(q), 1))
+    for a in range(0, len(r), step):
+        res += weights[a:a + step].dot(
+            np.sinc(np.outer(r[a:a + step], q / np.pi)))
+    return res
+
+
+def fromHistogram(counts, n, q, width=BIN_WIDTH):
+    """
+    Returns the normalized Debye sum of <n> beads at <q>, from the pair
+    distance histogram <counts> made with bin width <width>. Only the
+    occupied bins are evaluated.
+    """
+    occupied = np.nonzero(counts)[0]
+    r = (occupied + .5) * width
+    return (n + 2 * sincSum(r, q, counts[occupied])) / float(n) ** 2
+
+
+def debye(coords, q, exact=False, width=BIN_WIDTH):
+    """
+    Returns the Debye sum of the (n, 3) points <coords> at <q>,
+    normalized to 1 at q = 0. If <exact> is True, every pair is evaluated
+    at its own distance, otherwise the distances are binned.
+    """
+    n = len(coords)
+    if exact:
+        return (n + 2 * sincSum(pairDistances(coords), q)) / float(n) ** 2
+    return fromHistogram(histogram(coords, width), n, q, width)
+
+
+class DebyeAccumulator(object):
+    def __init__(self, q, blockSize=0):
+        """
+        Running mean and variance of Debye curves at <q>, updated one
+        frame at a time so that the frames don't have to be kept. With a
+        <blockSize>, the means of consecutive blocks of that many frames
+        are kept as well, for error bars that account for correlations
+        between frames.
+        """
+        self.q = q
+        self.blockSize = blockSize
+        self.n = 0
+        self.mean = np.zeros(len(q))
+        self.m2 = np.zeros(len(q))
+        self.blocks = []
+        self.blockSum = np.zeros(len(q))
+        self.blockN = 0
+
+    def add(self, I):
+        self.n += 1
+        delta = I - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (I - self.mean)
+        if self.blockSize:
+            self.blockSum += I
+            self.blockN += 1
+            if self.blockN == self.blockSize:
+                self.blocks.append(self.blockSum / self.blockSize)
+                self.blockSum = np.zeros(len(self.q))
+                self.blockN = 0
+
+    @property
+    def variance(self):
+        if self.n < 2:
+            return np.zeros(len(self.q))
+        return self.m2 / (self.n - 1)
+
+    @property
+    def error(self):
+        """
+        Standard error of the mean, from the block means if there are at
+        least two blocks, otherwise from the frame variance which ignores
+        correlations.
+        """
+        if len(self.blocks) >= 2:
+            return np.std(self.blocks, axis=0, ddof=1) / np.sqrt(
+                len(self.blocks))
+        return np.sqrt(self.variance / max(self.n, 1))
+
+    def state(self):
+        """
+        Returns the accumulated data as a dict of arrays, which
+        fromState() turns back into an accumulator.
+        """
+        return dict(q=self.q, blockSize=self.blockSize, n=self.n,
+                    mean=self.mean, m2=self.m2,
+                    blocks=np.array(self.blocks).reshape((-1, len(self.q))),
+                    blockSum=self.blockSum, blockN=self.blockN)
+
+    @classmethod
+    def fromState(cls, state):
+        acc = cls(state['q'], int(state['blockSize']))
+        acc.n, acc.blockN = int(state['n']), int(state['blockN'])
+        acc.mean, acc.m2 = state['mean'].copy(), state['m2'].copy()
+        acc.blocks = list(state['blocks'])
+        acc.blockSum = state['blockSum'].copy()
+        return acc
+
+    def save(self, filename):
+        """
+        Writes the state, the variance and the error of the mean to the
+        npz archive <filename>, through a temporary file so that a crash
+        can't leave a broken one behind.
+        """
+        with open(filename + '.tmp', 'wb') as fp:
+            np.savez(fp, variance=self.variance, error=self.error,
+                     **self.state())
+        os.replace(filename + '.tmp', filename)
+
+
+class PairHistogram(object):
+    def __init__(self, n, width=BIN_WIDTH):
+        """
+        Sum of the pair distance histograms of frames of <n> beads, in
+        bins of <width> bead diameters.
+        """
+        self.n = n
+        self.width = width
+        self.frames = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, counts):
+        """
+        Adds the histogram <counts> of one frame, see histogram().
+        """
+        if len(counts) > len(self.counts):
+            self.counts = np.pad(self.counts,
+                                 (0, len(counts) - len(self.counts)))
+        self.counts[:len(counts)] += counts
+        self.frames += 1
+
+    def curve(self, q, dist=1.):
+        """
+        Returns the mean normalized Debye curve of the frames at <q>,
+        with the coordinates scaled by <dist> as with -debye_dist.
+        """
+        return fromHistogram(self.counts / float(max(self.frames, 1)),
+                             self.n, q * dist, self.width)
+
+    def state(self):
+        return dict(n=self.n, width=self.width, frames=self.frames,
+                    counts=self.counts)
+
+    @classmethod
+    def fromState(cls, state):
+        hist = cls(int(state['n']), float(state['width']))
+        hist.frames = int(state['frames'])
+        hist.counts = state['counts'].astype(np.int64)
+        return hist
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads a histogram written by save(), such as <outputFile>.hist.
+        """
+        with np.load(filename) as npz:
+            return cls.fromState(npz)
+
+    def save(self, filename):
+        """
+        Writes the state to the npz archive <filename>, through a
+        temporary file like DebyeAccumulator.save().
+        """
+        with open(filename + '.tmp', 'wb') as fp:
+            np.savez(fp, **self.state())
+        os.replace(filename + '.tmp', filename)
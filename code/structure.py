@@ -0,0 +1,77 @@
+"""
+Structural observables of a Chains configuration, computed on every
+output frame when running with -observables. Lengths are in bead
+diameters, and quantities per chain are averaged over the chains.
+"""
+
+import numpy as np
+
+COLUMNS = ('Iteration', 'Rg', 'End-to-end', 'Persistence length',
+           'Clusters', 'Largest cluster')
+
+
+def gyrationRadius(coords):
+    """
+    Radius of gyration of each of the chains <coords>, an array of
+    shape (number, length, 3).
+    """
+    centered = coords - coords.mean(axis=1, keepdims=True)
+    return np.sqrt(np.mean(np.sum(centered ** 2, axis=-1), axis=1))
+
+
+def endToEnd(coords):
+    """
+    End-to-end distance of each of the chains <coords>.
+    """
+    return np.linalg.norm(coords[:, -1] - coords[:, 0], axis=-1)
+
+
+def persistenceLength(angles):
+    """
+    Persistence length from the mean cosine of the bend <angles>, for
+    unit bonds whose orientation correlation decays as <cos>**s. This is
+    infinite for straight chains and not defined if the mean cosine is
+    negative.
+    """
+    cos = np.mean(np.cos(angles))
+    if cos <= 0:
+        return np.nan
+    if cos >= 1:
+        return np.inf
+    return -1 / np.log(cos)
+
+
+def clusterSizes(n, i, j):
+    """
+    Sizes of the clusters of at least two of <n> beads which are joined
+    by the bonds between beads <i> and <j>.
+    """
+    labels = np.arange(n)
+    while True:
+        # give each bead the lowest label among its bonded neighbours,
+        # and follow the labels to their roots
+        new = labels.copy()
+        low = np.minimum(labels[i], labels[j])
+        np.minimum.at(new, i, low)
+        np.minimum.at(new, j, low)
+        new = new[new]
+        if np.array_equal(new, labels):
+            break
+        labels = new
+    sizes = np.bincount(labels)
+    return sizes[sizes > 1]
+
+
+def compute(chains):
+    """
+    Returns the mean radius of gyration, the mean end-to-end distance,
+    the persistence length, the number of clusters of beads joined by
+    sticky bonds and the size of the largest one.
+    """
+    coords = chains.coords
+    i, j, d = chains.pairs(chains.cells)
+    bonded = d < 1.2
+    sizes = clusterSizes(len(chains.beads), i[bonded], j[bonded])
+    return (np.mean(gyrationRadius(coords)), np.mean(endToEnd(coords)),
+            persistenceLength(chains.angles), len(sizes),
+            sizes.max() if len(sizes) else 0)
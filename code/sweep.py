@@ -0,0 +1,212 @@
+"""
+Script which sweeps a grid of chainSimulation.py parameters, runs a few
+seeds of every point over a pool of processes and scores the mean Debye
+curve of each point against the SAXS data. Finished runs are cached
+under their parameter hash and seed, so that extending or repeating a
+sweep only simulates what is missing.
+"""
+
+import numpy as np
+import multiprocessing
+import itertools
+import hashlib
+import json
+import os
+import time
+import sys
+import chainSimulation
+import ensemble
+import saxsData
+import fitting
+import scattering
+
+# settings which don't change the simulated trajectories, the curves
+# being computed from the pair distance histograms for any q and d
+UNHASHED = ('outputFile', 'seed', 'backend', 'trajFormat', 'checkpointFreq',
+            'resume', 'append', 'profileFreq', 'observables', 'bufferSize',
+            'flushTime', 'debye_flush', 'debye_stream', 'debye_dist',
+            'debye_max', 'debye_n', 'debye_exact', 'debye_blocks')
+
+
+def usage():
+    msg = (
+        '\nUsage:\n\n'
+        'sweep.py [options] <chainSimulation.py options>\n\n'
+        'Any chainSimulation.py option given a comma-separated list, like\n'
+        '-beta 1,1.1,1.2 or -debye_dist 45,50,55, is swept over, and all\n'
+        'combinations are simulated. Points which only differ in\n'
+        '-debye_dist or the q grid share their runs, the curves being\n'
+        'computed from the summed pair distance histograms.\n\n'
+        '  -data <n,n,..>:   data sets to score against, see saxsData.py\n'
+        '                    (default 221,226)\n'
+        '  -form <file>:     form factor of one bead as a Crysol .int file,\n'
+        '                    which the Debye curves are multiplied with\n'
+        '                    (default none)\n'
+        '  -qRange <a,b>:    q range of the data to fit (default all)\n'
+        '  -runs <n>:        number of seeds per point (default 4)\n'
+        '  -procs <n>:       number of processes (default the number of\n'
+        '                    cores)\n'
+        '  -burnin <n>:      number of accepted steps to discard from each\n'
+        '                    run before averaging, the same as\n'
+        '                    -debye_burnin (default 0)\n'
+        '  -cache <dir>:     directory of finished runs (default sweep)\n\n'
+        'Run i of a point is seeded with <seed> + i, -seed defaulting to 0.\n'
+        'The scores are written to <outputFile>.sweep, one line per point\n'
+        'with the fitted scale, background and chi2 against each data set.\n'
+    )
+    print(msg)
+    exit()
+
+
+def grid(argv):
+    """
+    Expands the comma-separated options of <argv>, returning the names
+    of the swept options and a list of (values, argv) for each point.
+    """
+    axes = [(i, argv[i + 1].split(',')) for i in range(len(argv) - 1)
+            if argv[i].startswith('-') and ',' in argv[i + 1]]
+    names = [argv[i] for i, values in axes]
+    points = []
+    for values in itertools.product(*[values for i, values in axes]):
+        argv_ = list(argv)
+        for (i, values_), value in zip(axes, values):
+            argv_[i + 1] = value
+        points.append((values, argv_))
+    return names, points
+
+
+def paramHash(opts):
+    """
+    Hash of the settings in <opts> which determine the simulated curves.
+    """
+    key = {k: v for k, v in opts.items() if k not in UNHASHED}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def runOne(job):
+    """
+    Runs one simulation in a pool process unless it is cached already,
+    and returns the path of its result.
+    """
+    opts, commandLine, path = job
+    if not os.path.exists(path):
+        result = chainSimulation.simulate(commandLine=commandLine,
+                                          progress=lambda *args: None,
+                                          **opts)
+        np.savez(path + '.tmp.npz', goodSteps=result['goodSteps'],
+                 **result['histogram'].state())
+        os.replace(path + '.tmp.npz', path)
+    return path
+
+
+def main(argv):
+    if '-help' in argv:
+        usage()
+    nums = [int(n) for n in chainSimulation.parse(argv, '-data', '221,226')
+            .split(',')]
+    formFile = chainSimulation.parse(argv, '-form', None)
+    qRange = chainSimulation.parse(argv, '-qRange', None)
+    runs = int(chainSimulation.parse(argv, '-runs', 4))
+    procs = int(chainSimulation.parse(argv, '-procs', os.cpu_count()))
+    burnin = chainSimulation.parse(argv, '-burnin', None)
+    cache = chainSimulation.parse(argv, '-cache', 'sweep')
+    seed = int(chainSimulation.parse(argv, '-seed', 0))
+    sweepArgs = ('-data', '-form', '-qRange', '-runs', '-procs', '-burnin',
+                 '-cache')
+    simArgv = []
+    for i, arg in enumerate(argv):
+        if arg in sweepArgs or (i and argv[i - 1] in sweepArgs):
+            continue
+        simArgv.append(arg)
+    names, points = grid(simArgv)
+    if qRange is not None:
+        qRange = [float(x) for x in qRange.split(',')]
+    outputFile = chainSimulation.parse(simArgv, '-outputFile', 'out')
+    if not os.path.exists(cache):
+        os.makedirs(cache)
+
+    # collect the runs of all points, skipping those already done
+    jobs, paths, qs, dists, queued = [], [], [], [], set()
+    for values, argv_ in points:
+        opts = chainSimulation.parseArgs(argv_)
+        if burnin is not None:
+            if ('-debye_burnin' in argv_
+                    and int(burnin) != opts['debye_burnin']):
+                print("-burnin and -debye_burnin disagree, give only one of "
+                      "them!\n")
+                exit()
+            opts['debye_burnin'] = int(burnin)
+        opts.update(debye=True, append=False, resume=False)
+        key = paramHash(opts)
+        qs.append(np.linspace(0, opts['debye_max'], opts['debye_n']))
+        dists.append(opts['debye_dist'])
+        paths.append([])
+        for i in range(1, runs + 1):
+            base = os.path.join(cache, '%s_%d' % (key, seed + i))
+            path = base + '.result.npz'
+            paths[-1].append(path)
+            if not (os.path.exists(path) or path in queued):
+                queued.add(path)
+                opts_ = dict(opts, outputFile=base, seed=seed + i)
+                argv__ = ensemble.runArgv(argv_, base, seed + i)
+                jobs.append((opts_, ' '.join(argv__) + ' ', path))
+    total = len(set(sum(paths, [])))
+    print('%d points x %d runs, %d distinct runs, %d cached, %d to simulate'
+          % (len(points), runs, total, total - len(jobs), len(jobs)))
+
+    t0 = time.time()
+    if jobs:
+        with multiprocessing.Pool(min(procs, len(jobs))) as pool:
+            for k, path in enumerate(pool.imap_unordered(runOne, jobs)):
+                t = time.time()
+                remaining = float(len(jobs) - k - 1) * (t - t0) / (k + 1)
+                print('   %d/%d runs: %.1fs, %.0fs remaining'
+                      % (k + 1, len(jobs), t - t0, remaining))
+
+    # score the mean curve of every point on its own q grid against the
+    # data, weighting the runs equally
+    qData, I, err = saxsData.loadMany(nums)
+    crysol = None
+    if formFile is not None:
+        crysol = np.loadtxt(formFile, skiprows=1)[:, :2]
+    scores = []
+    for paths_, q, dist in zip(paths, qs, dists):
+        hists = [scattering.PairHistogram.load(path) for path in paths_]
+        hists = [h for h in hists if h.frames]
+        if not hists:
+            print('No frames after the burn-in, nothing to score.')
+            return
+        curve = np.mean([h.curve(q, dist) for h in hists], axis=0)
+        formFactor = None
+        if crysol is not None:
+            formFactor = (np.interp(q, crysol[:, 0], crysol[:, 1])
+                          / crysol[0, 1])
+        result = fitting.fit(q, curve, qData, I, err, formFactor=formFactor,
+                             qRange=qRange)
+        scores.append(np.stack([result[key][0] for key in
+                                ('scale', 'background', 'chi2')], axis=-1))
+    # (points, samples, [scale, background, chi2])
+    scores = np.array(scores)
+
+    # the swept values are written as given, as they needn't be numbers
+    header = ' '.join(name[1:] for name in names)
+    for num in nums:
+        header += ' scale_%d background_%d chi2_%d' % (num, num, num)
+    with open(outputFile + '.sweep', 'w') as fp:
+        fp.write('# ' + header.strip() + '\n')
+        for (values, argv_), score in zip(points, scores):
+            fp.write(' '.join(list(values) + ['%g' % x
+                                              for x in score.ravel()])
+                     + '\n')
+    print('\nSweep done in %.1fs, scores written to %s.sweep'
+          % (time.time() - t0, outputFile))
+    for j, num in enumerate(nums):
+        k = np.argmin(scores[:, j, 2])
+        print('Best for %d: %s, chi2 %.2f'
+              % (num, ' '.join('%s %s' % (name, value) for name, value
+                               in zip(names, points[k][0])),
+                 scores[k, j, 2]))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
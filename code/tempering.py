@@ -0,0 +1,170 @@
+"""
+Script which runs a parallel tempering (replica exchange) simulation:
+several replicas of the same system are simulated at a ladder of beta
+values, one process each, and neighbouring replicas periodically swap
+configurations according to the Metropolis condition on their bond
+counts.
+"""
+
+import numpy as np
+import multiprocessing
+import time
+import sys
+import chainSimulation
+
+
+def usage():
+    msg = (
+        '\nUsage:\n\n'
+        'tempering.py [options] <chainSimulation.py options>\n\n'
+        '  -replicas <n>:    number of replicas, with beta values evenly\n'
+        '                    spaced from -beta_min up to -beta (default 4)\n'
+        '  -beta_min <b>:    the lowest beta of the ladder (default 0)\n'
+        '  -betas <b,b,..>:  comma-separated beta values, instead of the\n'
+        '                    even ladder\n'
+        '  -swapFreq <n>:    number of steps between swap attempts\n'
+        '                    (default 100)\n\n'
+        'Replica k of the ladder, in order of increasing beta, writes its\n'
+        'output to <outputFile>_<k>, so that the last one samples -beta.\n'
+        'Replica k is seeded with <seed> + k + 1 if -seed is given,\n'
+        'otherwise with a random seed.\n'
+        'Simulated annealing with -ramps is not used.\n'
+    )
+    print(msg)
+    exit()
+
+
+def replica(conn, opts):
+    """
+    Runs one replica in its own process, taking commands from <conn>.
+    """
+    sim = chainSimulation.Simulation(progress=lambda *args: None, **opts)
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == 'run':
+            sim.run(arg)
+            conn.send(sim.chains.bonds)
+        elif cmd == 'get':
+            conn.send(sim.chains.state())
+        elif cmd == 'set':
+            sim.chains.setState(arg)
+            conn.send(None)
+        elif cmd == 'finish':
+            conn.send(sim.finish())
+            break
+
+
+def send(conns, k, message):
+    """
+    Sends <message> to replica <k>, raising RuntimeError if it stopped.
+    """
+    try:
+        conns[k].send(message)
+    except (BrokenPipeError, ConnectionResetError):
+        raise RuntimeError('Replica %d stopped, see its error above' % k)
+
+
+def receive(conns, k):
+    """
+    Returns the next answer of replica <k>, raising RuntimeError if it
+    stopped.
+    """
+    try:
+        return conns[k].recv()
+    except (EOFError, ConnectionResetError):
+        raise RuntimeError('Replica %d stopped, see its error above' % k)
+
+
+def swapAccepted(beta1, beta2, bonds1, bonds2):
+    """
+    Metropolis condition for swapping two replicas, with the energy
+    being minus the number of bonds.
+    """
+    delta = (beta2 - beta1) * (bonds1 - bonds2)
+    return (delta >= 0) or (np.random.rand() < np.exp(delta))
+
+
+def main(argv):
+    if '-help' in argv:
+        usage()
+    opts = chainSimulation.parseArgs(argv)
+    opts['ramps'] = 0
+    betas = chainSimulation.parse(argv, '-betas', None)
+    if betas is None:
+        replicas = int(chainSimulation.parse(argv, '-replicas', 4))
+        beta_min = float(chainSimulation.parse(argv, '-beta_min', 0))
+        betas = np.linspace(beta_min, opts['beta'], replicas)
+    else:
+        betas = np.sort(np.array(betas.split(','), dtype=float))
+    swapFreq = int(chainSimulation.parse(argv, '-swapFreq', 100))
+    outputFile, nSteps, seed = (opts['outputFile'], opts['nSteps'],
+                                opts['seed'])
+    if seed is None:
+        seeds = np.random.randint(2 ** 31, size=len(betas))
+    else:
+        np.random.seed(seed)
+        seeds = seed + np.arange(1, len(betas) + 1)
+
+    # start one process per replica
+    conns, procs = [], []
+    for k, beta in enumerate(betas):
+        opts_ = dict(opts, beta=beta, outputFile='%s_%d' % (outputFile, k),
+                     seed=int(seeds[k]), commandLine=' '.join(argv) + ' ')
+        parent, child = multiprocessing.Pipe()
+        # daemons, so that they don't outlive a failure of this process
+        proc = multiprocessing.Process(target=replica, args=(child, opts_),
+                                       daemon=True)
+        proc.start()
+        # close our copy of the replica's end, so that receive() notices
+        # when the replica stops
+        child.close()
+        conns.append(parent)
+        procs.append(proc)
+
+    # run all replicas for swapFreq steps at a time and then try to swap
+    # neighbours, alternating between even and odd pairs
+    t0 = time.time()
+    tried, swapped = np.zeros(len(betas) - 1), np.zeros(len(betas) - 1)
+    step, cycle = 0, 0
+    while step < nSteps:
+        for k in range(len(conns)):
+            send(conns, k, ('run', swapFreq))
+        bonds = [receive(conns, k) for k in range(len(conns))]
+        step = min(step + swapFreq, nSteps)
+        for k in range(cycle % 2, len(betas) - 1, 2):
+            tried[k] += 1
+            if swapAccepted(betas[k], betas[k + 1], bonds[k], bonds[k + 1]):
+                swapped[k] += 1
+                send(conns, k, ('get', None))
+                send(conns, k + 1, ('get', None))
+                state, state_ = receive(conns, k), receive(conns, k + 1)
+                send(conns, k, ('set', state_))
+                send(conns, k + 1, ('set', state))
+                receive(conns, k)
+                receive(conns, k + 1)
+        cycle += 1
+        if (step % opts['outputFreq'] < swapFreq) or (step == nSteps):
+            t = time.time()
+            remaining = float(nSteps - step) * (t - t0) / step
+            print('   step %d/%d: %.1fs, %.1fs remaining, bonds %s'
+                  % (step, nSteps, t - t0, remaining,
+                     ' '.join(str(b) for b in bonds)))
+
+    results = []
+    for k, proc in enumerate(procs):
+        send(conns, k, ('finish', None))
+        results.append(receive(conns, k))
+        proc.join()
+
+    print('\nParallel tempering done in %.1fs' % (time.time() - t0))
+    for k, beta in enumerate(betas):
+        print('Replica %d, beta=%.2f: acceptance rate %.1f%%'
+              % (k, beta, 100 * float(results[k]['goodSteps']) / nSteps)
+              + ('' if k == len(betas) - 1 else
+                 ', swap rate %.1f%%' % (100 * swapped[k] / max(tried[k], 1))))
+    print('Trajectory at beta=%.2f written to %s_%d.pdb'
+          % (betas[-1], outputFile, len(betas) - 1))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,251 @@
+"""
+Trajectory files: the PDB frames written by Chains.dump(), and a compact
+binary format. A binary trajectory has a 64-byte header followed by
+fixed-size frame records, each holding the number of accepted steps as
+an int64 and the coordinates as float32. Frame k therefore starts at a
+known offset and can be read without scanning the file.
+
+TrajectoryReader reads frames of either format lazily, by number or
+in order. Run as a script to convert a binary trajectory to PDB for VMD:
+
+    python trajectory.py out.bin out.pdb
+"""
+
+import numpy as np
+import mmap
+import os
+import sys
+import writers
+
+MAGIC = b'CHAINTRJ'
+VERSION = 1
+HEADER = 64
+
+
+def pdbFrame(coords):
+    """
+    Returns the PDB text of one frame of the (number, length, 3) array
+    <coords>, as written by Chains.dump().
+    """
+    number, length = coords.shape[:2]
+    names = (['A', 'B'] + ['C'] * length)[:length]
+    lines = ['MODEL \n']
+    for j, chain in enumerate(coords.tolist()):
+        for i, (x, y, z) in enumerate(chain):
+            lines.append(
+                "ATOM  %5d    %s AAA A%4d    %8.3f%8.3f%8.3f\n"
+                % (j * length + i, names[i], j, x, y, z)
+            )
+        lines.append('TER   \n')
+    lines.append('ENDMDL\n')
+    return ''.join(lines)
+
+
+def frameType(number, length):
+    """
+    The numpy dtype of one frame record.
+    """
+    return np.dtype([('step', '<i8'), ('coords', '<f4', (number, length, 3))])
+
+
+def readHeader(fp):
+    """
+    Reads the header of the open binary trajectory <fp>, returning the
+    number of chains and their length.
+    """
+    head = fp.read(HEADER)
+    if head[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a binary trajectory' % fp.name)
+    version, number, length = np.frombuffer(head[8:20], dtype='<u4')
+    if version != VERSION:
+        raise ValueError('%s has unknown version %d' % (fp.name, version))
+    return int(number), int(length)
+
+
+class TrajectoryWriter(object):
+    def __init__(self, filename, number, length, append=False,
+                 bufferSize=writers.BUFFER_SIZE, flushTime=writers.FLUSH_TIME):
+        """
+        Opens the binary trajectory <filename> for frames of <number>
+        chains of <length> beads, and keeps it open until close(). With
+        <append>, frames are added to an existing file, after dropping
+        any incomplete last record. Frames are buffered as described in
+        writers.BufferedWriter.
+        """
+        self.dtype = frameType(number, length)
+        self.record = np.zeros(1, dtype=self.dtype)
+        if append:
+            with open(filename, 'rb') as fp:
+                if readHeader(fp) != (number, length):
+                    raise ValueError('%s holds a different system' % filename)
+            frames = (os.path.getsize(filename) - HEADER) // self.dtype.itemsize
+            os.truncate(filename, HEADER + frames * self.dtype.itemsize)
+        else:
+            with open(filename, 'wb') as fp:
+                head = MAGIC + np.array([VERSION, number, length],
+                                        dtype='<u4').tobytes()
+                fp.write(head.ljust(HEADER, b'\0'))
+        self.fp = writers.BufferedWriter(filename, 'a', bufferSize, flushTime)
+
+    def write(self, coords, step):
+        self.record['step'] = step
+        self.record['coords'] = coords
+        self.fp.write(self.record.tobytes())
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+class TrajectoryReader(object):
+    def __init__(self, filename, cache=True):
+        """
+        Opens the binary or PDB trajectory <filename> for reading frames
+        on demand. A binary trajectory is memory-mapped. For a PDB file
+        the byte offsets of the frames are found once and kept in
+        <filename>.idx if <cache>, from where they are reused, or
+        extended if frames have been appended since. An incomplete last
+        frame is ignored in both formats.
+        """
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            self.binary = fp.read(len(MAGIC)) == MAGIC
+        if self.binary:
+            with open(filename, 'rb') as fp:
+                self.number, self.length = readHeader(fp)
+            dtype = frameType(self.number, self.length)
+            frames = (os.path.getsize(filename) - HEADER) // dtype.itemsize
+            if frames:
+                self.data = np.memmap(filename, dtype=dtype, mode='r',
+                                      offset=HEADER, shape=(frames,))
+            else:
+                self.data = np.zeros(0, dtype=dtype)
+            self.steps = self.data['step']
+        else:
+            self.starts, self.ends = self._index(cache)
+            self.steps = None
+            self.number, self.length = 0, 0
+            if len(self.starts):
+                text = self._text(0)
+                atoms = sum(line.startswith(b'ATOM')
+                            for line in text.split(b'\n'))
+                self.number = text.count(b'\nTER')
+                self.length = atoms // max(self.number, 1)
+
+    def _index(self, cache):
+        filename, idxFile = self.filename, self.filename + '.idx'
+        st = os.stat(filename)
+        starts, ends, head = [], [], None
+        if cache and os.path.exists(idxFile):
+            with np.load(idxFile) as idx:
+                if (int(idx['mtime']), int(idx['size'])) == (st.st_mtime_ns,
+                                                             st.st_size):
+                    return idx['starts'], idx['ends']
+                starts, ends = list(idx['starts']), list(idx['ends'])
+                head = bytes(idx['head'])
+        with open(filename, 'rb') as fp:
+            # keep the frames indexed so far only if the file still
+            # starts with the same frame, and just extend the index
+            if starts and (fp.read(len(head)) != head
+                           or ends[-1] > st.st_size):
+                starts, ends = [], []
+            i = ends[-1] if ends else 0
+            if st.st_size > i:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                i = data.find(b'MODEL', i)
+                while i >= 0:
+                    j = data.find(b'ENDMDL\n', i)
+                    if j < 0:
+                        break
+                    starts.append(i)
+                    ends.append(j + 7)
+                    i = data.find(b'MODEL', j + 7)
+                data.close()
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        if cache and len(starts):
+            with open(filename, 'rb') as fp:
+                head = fp.read(min(int(ends[0]), 4096))
+            with open(idxFile + '.tmp', 'wb') as fp:
+                np.savez(fp, starts=starts, ends=ends, mtime=st.st_mtime_ns,
+                         size=st.st_size, head=np.frombuffer(head, np.uint8))
+            os.replace(idxFile + '.tmp', idxFile)
+        return starts, ends
+
+    def _text(self, k):
+        with open(self.filename, 'rb') as fp:
+            fp.seek(self.starts[k])
+            return fp.read(self.ends[k] - self.starts[k])
+
+    def __len__(self):
+        return len(self.data) if self.binary else len(self.starts)
+
+    def __getitem__(self, k):
+        """
+        Frame <k> as a float64 array of shape (number, length, 3), or
+        for a slice an array of such frames. Slices of a binary
+        trajectory are float32 views of the memory map, which are only
+        read from disk as they are used.
+        """
+        if isinstance(k, slice):
+            if self.binary:
+                return self.data['coords'][k]
+            return np.array([self[i] for i in range(*k.indices(len(self)))])
+        if not -len(self) <= k < len(self):
+            raise IndexError('%s has %d frames' % (self.filename, len(self)))
+        k = k % len(self)
+        if self.binary:
+            return self.data['coords'][k].astype(np.float64)
+        lines = [line for line in self._text(k).split(b'\n')
+                 if line.startswith(b'ATOM')]
+        coords = np.array([(line[30:38], line[38:46], line[46:54])
+                           for line in lines]).astype(np.float64)
+        return coords.reshape((self.number, self.length, 3))
+
+    def frames(self, start=0, stop=None):
+        """
+        Generates the frames from <start> up to <stop> one at a time,
+        with the accepted step count of each, which is None for PDB.
+        """
+        for k in range(*slice(start, stop).indices(len(self))):
+            yield self[k], None if self.steps is None else int(self.steps[k])
+
+    def after(self, goodSteps):
+        """
+        The first frame written at or after <goodSteps> accepted steps,
+        for skipping a burn-in, which needs the step counts of the
+        binary format.
+        """
+        if self.steps is None:
+            raise ValueError('%s has no step counts' % self.filename)
+        return int(np.searchsorted(self.steps, goodSteps))
+
+
+def readFrame(filename, k=-1):
+    """
+    Reads frame <k> of a binary or PDB trajectory, by default the last
+    one. Returns the coordinates as float64 and the accepted step count,
+    which is None for PDB.
+    """
+    reader = TrajectoryReader(filename)
+    coords = reader[k]
+    step = None if reader.steps is None else int(reader.steps[k])
+    return coords, step
+
+
+def toPdb(filename, pdbFile):
+    """
+    Converts the binary trajectory <filename> to the PDB file <pdbFile>.
+    """
+    with open(pdbFile, 'w') as out:
+        for coords, step in TrajectoryReader(filename).frames():
+            out.write(pdbFrame(coords))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('\nUsage:\n\ntrajectory.py <binary trajectory> <pdb file>\n')
+        exit()
+    toPdb(sys.argv[1], sys.argv[2])
@@ -0,0 +1,125 @@
+"""
+Buffered output files for long runs. A BufferedWriter keeps its file
+open for the whole run and collects what is written in memory. The data
+goes to disk on a background thread, either when the buffer is full or
+when it has waited for long enough, so that frequent small outputs
+cost few system calls and don't stall the simulation on slow storage.
+
+Every writer which is still open is flushed when the interpreter exits,
+and after handleSignals() also when the process is terminated.
+"""
+
+import atexit
+import signal
+import threading
+import weakref
+import sys
+
+# default buffer size in bytes, and the longest time data waits in it
+BUFFER_SIZE = 2 ** 20
+FLUSH_TIME = 5.
+
+_open = weakref.WeakSet()
+
+
+class BufferedWriter(object):
+    def __init__(self, filename, mode='a', bufferSize=BUFFER_SIZE,
+                 flushTime=FLUSH_TIME):
+        """
+        Opens <filename> in <mode>, 'a' or 'w', for writing through a
+        buffer of <bufferSize> bytes which is flushed at least every
+        <flushTime> seconds.
+        """
+        self.name = filename
+        self.fp = open(filename, mode.replace('b', '') + 'b')
+        self.bufferSize, self.flushTime = bufferSize, flushTime
+        self.chunks, self.size = [], 0
+        # the first lock protects the buffer, the second keeps writes to
+        # the file in order
+        self.lock = threading.Lock()
+        self.ioLock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        _open.add(self)
+
+    def write(self, data):
+        """
+        Adds the str or bytes <data> to the buffer.
+        """
+        if self.error is not None:
+            raise self.error
+        if isinstance(data, str):
+            data = data.encode()
+        with self.lock:
+            self.chunks.append(data)
+            self.size += len(data)
+            full = self.size >= self.bufferSize
+        if full:
+            self.wake.set()
+
+    def _write(self):
+        with self.ioLock:
+            with self.lock:
+                chunks, self.chunks, self.size = self.chunks, [], 0
+            if chunks:
+                self.fp.write(b''.join(chunks))
+                self.fp.flush()
+
+    def _run(self):
+        while not self.closed:
+            self.wake.wait(self.flushTime)
+            self.wake.clear()
+            try:
+                self._write()
+            except Exception as e:
+                self.error = e
+                return
+
+    def flush(self):
+        """
+        Writes everything buffered so far before returning.
+        """
+        if self.error is not None:
+            raise self.error
+        self._write()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+        self.flush()
+        self.fp.close()
+        _open.discard(self)
+
+
+def flushAll():
+    """
+    Flushes every open writer.
+    """
+    for writer in list(_open):
+        if not writer.closed:
+            writer.flush()
+
+
+def _terminate(signum, frame):
+    # exit normally, so that atexit flushes the writers
+    sys.exit(128 + signum)
+
+
+def handleSignals():
+    """
+    Makes SIGTERM and SIGHUP exit the process normally instead of
+    killing it, so that the open writers are flushed. Only possible from
+    the main thread.
+    """
+    for name in ('SIGTERM', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), _terminate)
+
+
+atexit.register(flushAll)
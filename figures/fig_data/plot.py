@@ -5,28 +5,26 @@ BMC biology: width 85 or 175 mm, so 3.35 or 6.89 inches
 import matplotlib.pyplot as plt
 import matplotlib
 import numpy as np
+import sys
+sys.path.insert(0, '../../code')
+import saxsData
 
 font = {'size': 12}
 matplotlib.rc('font', **font)
 plt.ion()
 
 
-def read(*nums, conc=1):
-    pattern = '../../data/RBNX_%d_sub.dat'
-    dilutions = [1, 2, 4, 10]
-    rtn = []
-    for i in range(len(nums)):
-        data = np.loadtxt(pattern % nums[i], skiprows=3)[:, :-2]
-        data[:, 1] /= conc / dilutions[i]
-        rtn.append(data)
-    return rtn
+def read(*nums):
+    # concentrations and dilutions from saxsData.SAMPLES
+    q, I, err = saxsData.loadMany(nums)
+    return [np.vstack((q, I_)).T for I_ in I]
 
 
 # load data
-mono_A = read(210, 212, conc=5.01e-3)
-mono_AB = read(215, 218, conc=7.31e-3)
-fimb_A = read(221, 223, 296, conc=7.14e-3)
-fimb_AB = read(226, 228, 299, conc=12.2e-3)
+mono_A = read(210, 212)
+mono_AB = read(215, 218)
+fimb_A = read(221, 223, 296)
+fimb_AB = read(226, 228, 299)
 
 # plot data
 fig, ax = plt.subplots(ncols=2, sharex=True, sharey=True, figsize=(6.89, 3))
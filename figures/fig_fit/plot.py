@@ -5,7 +5,10 @@ BMC biology: width 85 or 175 mm, so 3.35 or 6.89 inches
 import matplotlib.pyplot as plt
 import matplotlib
 import numpy as np
-import os
+import sys
+sys.path.insert(0, '../../code')
+import saxsData
+import fitting
 
 
 font = {'size': 12}
@@ -26,48 +29,37 @@ plt.subplots_adjust(
 
 samples = [
     {'name': 'fimbriae_A', 'conc': 7.14e-3, 'color': 'dodgerblue',
-     'scale': 1.15, 'num': 221, 'sub': 6e-2, 'start': 20000,
-     'd': 5.0},
+     'num': 221, 'start': 20000, 'd': 5.0},
     {'name': 'fimbriae_AB', 'conc': 12.2e-3, 'color': 'orange',
-     'scale': .60, 'num': 226, 'sub': 1.5e-2, 'start': 20000,
-     'd': 5.5}
+     'num': 226, 'start': 20000, 'd': 5.5}
 ]
 
 for i, sample in enumerate(samples):
     # Read simulations
-    files = os.listdir(sample['name'])
-    runs = [n.split('.')[0] for n in files if n.endswith('.npz')]
+    runs, q, F2_debye, trajs = fitting.loadRuns(sample['name'],
+                                                sample['start'])
     print('%s: loading' % sample['name'], runs)
-    steps, bonds, angles, F2_debye = [], [], [], []
-    for run in runs:
-        steps_, bonds_, angles_ = np.loadtxt(
-            '%s/%s.traj' % (sample['name'], run), skiprows=1
-        ).T
-        steps.append(steps_)
-        bonds.append(bonds_)
-        angles.append(angles_)
-        dct = np.load('%s/%s.npz' % (sample['name'], run))
-        q = dct['q']
-        assert np.allclose(crysol[:, 0], q)
-        F2_debye.append(
-            np.mean(
-                dct['I'][np.where(steps_ >= sample['start'])[0][0]:], axis=0
-            )
-        )
+    steps, bonds, angles = zip(*trajs)
+    assert np.allclose(crysol[:, 0], q)
 
     # Experimental data in absolute units
-    pattern = '../../data/RBNX_%d_sub.dat'
-    data = np.loadtxt(pattern % sample['num'], skiprows=3)[:, :-2]
-    data[:, 1] /= sample['conc']
-    data[:, 1] -= sample['sub']
-    ax[i].plot(data[:, 0], data[:, 1], '.', ms=7, color=sample['color'])
+    data = saxsData.load(sample['num'], conc=sample['conc'])
 
-    # Model in absolute units
+    # Model in absolute units, with the scale and flat background fitted
     drho = 2e10  # cm/g
     N_A = 6.022e23  # 1/mol
     M = 16.5e3 * 2 * 40  # g / mol
-    absfactor = sample['scale'] * M * (drho**2) / N_A
-    ax[i].plot(q, np.mean(F2_debye, axis=0) * F2_form * absfactor, 'k')
+    absfactor = M * (drho**2) / N_A
+    result = fitting.fit(q, np.mean(F2_debye, axis=0) * absfactor,
+                         data[:, 0], data[:, 1], data[:, 2],
+                         formFactor=F2_form)
+    scale, sub = result['scale'][0, 0], result['background'][0, 0]
+    print('%s: scale %.3f, background %.3g, chi2 %.2f'
+          % (sample['name'], scale, sub, result['chi2'][0, 0]))
+    ax[i].plot(data[:, 0], data[:, 1] - sub, '.', ms=7,
+               color=sample['color'])
+    ax[i].plot(q, np.mean(F2_debye, axis=0) * F2_form * absfactor * scale,
+               'k')
     ax[i].set_xscale('log')
     ax[i].set_yscale('log')
     ax[i].set_xlim(data[0, 0] / 2, data[-1, 0] * 1.5)